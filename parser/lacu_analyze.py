@@ -0,0 +1,285 @@
+import re
+import json
+
+from lacu_tokens import tokenize_side
+
+WHITESPACE = re.compile(r"\s+")
+PLACEHOLDER_KINDS = {"group": "[]", "pair": "<>"}
+
+
+def normalize_side(text):
+    # placeholders are reduced to their kind, so sides that only differ in which
+    # group or pair group they draw from normalize to the same text
+    parts = []
+    for token in tokenize_side(text, ""):
+        if token["type"] == "literal":
+            parts.append(token["text"])
+        else:
+            parts.append(PLACEHOLDER_KINDS[token["type"]])
+    return WHITESPACE.sub(" ", "".join(parts)).strip().casefold()
+
+
+def template_references(template):
+    # distinct group names, and the aliases used of each pair group, in order
+    group_names = {}
+    pair_columns = {}
+    for side in template.sides:
+        for token in tokenize_side(side, ""):
+            if token["type"] == "group":
+                group_names[token["group"]] = None
+            elif token["type"] == "pair":
+                aliases = pair_columns.setdefault(token["pair_group"], {})
+                if token["alias"] is not None:
+                    aliases[token["alias"]] = None
+    return list(group_names), {
+        name: list(aliases) for name, aliases in pair_columns.items()
+    }
+
+
+def repeated(buckets):
+    # keep only the hash buckets that were hit more than once, in first-seen order
+    return [locations for locations in buckets.values() if len(locations) > 1]
+
+
+def find_duplicate_selectables(deck):
+    buckets = {}
+    for category in deck.categories:
+        for count, selectable in enumerate(category.selectables):
+            key = (tuple(category.variant_names), tuple(selectable.variants))
+            buckets.setdefault(key, []).append(
+                {"category": category.name, "index": count}
+            )
+    return [
+        {"variants": list(selectable_key[1]), "locations": locations}
+        for selectable_key, locations in buckets.items()
+        if len(locations) > 1
+    ]
+
+
+def find_duplicate_groups(deck):
+    buckets = {}
+    for group in deck.groups:
+        key = (group.category_name, group.key_variant_name, frozenset(group.keys))
+        buckets.setdefault(key, []).append(group.name)
+    return [{"groups": names} for names in repeated(buckets)]
+
+
+def find_duplicate_group_keys(deck):
+    duplicates = []
+    for group in deck.groups:
+        seen = set()
+        for key in group.keys:
+            if key in seen:
+                duplicates.append({"group": group.name, "key": key})
+            seen.add(key)
+    return duplicates
+
+
+def find_duplicate_pairs(deck):
+    # pairs only collide if their columns are typed the same way
+    buckets = {}
+    for pair_group in deck.pair_groups:
+        if not pair_group:
+            continue
+        for count, pair in enumerate(pair_group.pairs):
+            key = (tuple(pair_group.column_types), tuple(pair))
+            buckets.setdefault(key, []).append(
+                {"pair_group": pair_group.name, "index": count}
+            )
+    return [
+        {"pair": list(pair_key[1]), "locations": locations}
+        for pair_key, locations in buckets.items()
+        if len(locations) > 1
+    ]
+
+
+def find_duplicate_templates(deck):
+    exact = {}
+    near = {}
+    for chapter in deck.chapters:
+        if not chapter:
+            continue
+        for count, template in enumerate(chapter.templates):
+            location = {"chapter": chapter.name, "index": count}
+            exact.setdefault(tuple(template.sides), []).append(location)
+            normalized = tuple(normalize_side(side) for side in template.sides)
+            near.setdefault(normalized, {}).setdefault(
+                tuple(template.sides), []
+            ).append(location)
+
+    exact_duplicates = [
+        {"sides": list(sides), "locations": locations}
+        for sides, locations in exact.items()
+        if len(locations) > 1
+    ]
+    # near duplicates are only interesting where the raw sides actually differ
+    near_duplicates = [
+        {
+            "normalized_sides": list(normalized),
+            "variants": [
+                {"sides": list(sides), "locations": locations}
+                for sides, locations in variants.items()
+            ],
+        }
+        for normalized, variants in near.items()
+        if len(variants) > 1
+    ]
+    return exact_duplicates, near_duplicates
+
+
+def find_near_duplicate_sides(deck):
+    buckets = {}
+    for chapter in deck.chapters:
+        if not chapter:
+            continue
+        for count, template in enumerate(chapter.templates):
+            for side_count, side in enumerate(template.sides):
+                normalized = normalize_side(side)
+                buckets.setdefault(normalized, {}).setdefault(side, []).append(
+                    {"chapter": chapter.name, "index": count, "side": side_count}
+                )
+    return [
+        {
+            "normalized": normalized,
+            "variants": [
+                {"side": side, "locations": locations}
+                for side, locations in sides.items()
+            ],
+        }
+        for normalized, sides in buckets.items()
+        if len(sides) > 1
+    ]
+
+
+def find_repeated_vocab(deck):
+    buckets = {}
+    for chapter in deck.chapters:
+        if not chapter:
+            continue
+        for vocab in chapter.vocab:
+            for key in vocab.keys:
+                bucket_key = (vocab.category_name, vocab.key_variant_name, key)
+                buckets.setdefault(bucket_key, []).append(chapter.name)
+    return [
+        {
+            "category": vocab_key[0],
+            "key_variant": vocab_key[1],
+            "key": vocab_key[2],
+            "chapters": chapters,
+        }
+        for vocab_key, chapters in buckets.items()
+        if len(chapters) > 1
+    ]
+
+
+def find_duplicates(deck):
+    exact_templates, near_templates = find_duplicate_templates(deck)
+    return {
+        "selectables": find_duplicate_selectables(deck),
+        "groups": find_duplicate_groups(deck),
+        "group_keys": find_duplicate_group_keys(deck),
+        "pairs": find_duplicate_pairs(deck),
+        "templates": exact_templates,
+        "near_duplicate_templates": near_templates,
+        "near_duplicate_sides": find_near_duplicate_sides(deck),
+        "vocab": find_repeated_vocab(deck),
+    }
+
+
+def write_report(report, report_file):
+    with open(report_file, "w") as file:
+        json.dump(report, file, indent=4)
+
+
+class CardCounter:
+    # Counts the cards a template expands to without expanding it. Every
+    # distinct group referenced by a template picks one of its keys, and every
+    # referenced pair group picks one of its pairs; a pair's group-typed members
+    # that the template uses pick one of that group's keys in turn.
+    def __init__(self, deck):
+        self.groups = {}
+        for group in deck.groups:
+            self.groups.setdefault(group.name, group)
+        self.pair_groups = {}
+        for pair_group in deck.pair_groups:
+            if pair_group:
+                self.pair_groups.setdefault(pair_group.name, pair_group)
+        # pair group weights only depend on which columns are referenced
+        self.pair_weights = {}
+
+    def group_size(self, group_name):
+        group = self.groups.get(group_name)
+        return len(group.keys) if group else 0
+
+    def group_columns(self, pair_group, aliases):
+        columns = []
+        for count, (name, type) in enumerate(
+            zip(pair_group.column_names, pair_group.column_types)
+        ):
+            if name in aliases and type.split(":")[0] == "group":
+                columns.append(count)
+        return tuple(columns)
+
+    def cumulative_pair_weights(self, pg_name, aliases):
+        # the referenced group-typed columns, and the running total of cards
+        # over the pairs of the pair group
+        pair_group = self.pair_groups.get(pg_name)
+        if not pair_group:
+            return (), [0]
+        columns = self.group_columns(pair_group, aliases)
+        key = (pg_name, columns)
+        if key not in self.pair_weights:
+            cumulative = [0]
+            for pair in pair_group.pairs:
+                cards = 1
+                for count in columns:
+                    cards *= self.group_size(pair[count])
+                cumulative.append(cumulative[-1] + cards)
+            self.pair_weights[key] = (columns, cumulative)
+        return self.pair_weights[key]
+
+    def pair_group_size(self, pg_name, aliases):
+        return self.cumulative_pair_weights(pg_name, aliases)[1][-1]
+
+    def count_template(self, template):
+        group_names, pair_columns = template_references(template)
+        cards = 1
+        for group_name in group_names:
+            cards *= self.group_size(group_name)
+        for pg_name, aliases in pair_columns.items():
+            cards *= self.pair_group_size(pg_name, aliases)
+        return cards
+
+
+def count_cards(deck, budget=None):
+    counter = CardCounter(deck)
+    chapters = []
+    over_budget = []
+    total = 0
+    for chapter in deck.chapters:
+        if not chapter:
+            continue
+        templates = []
+        for count, template in enumerate(chapter.templates):
+            cards = counter.count_template(template)
+            templates.append({"index": count, "cards": cards})
+            if budget is not None and cards > budget:
+                over_budget.append(
+                    {"chapter": chapter.name, "index": count, "cards": cards}
+                )
+        chapter_cards = sum(t["cards"] for t in templates)
+        chapters.append(
+            {
+                "name": chapter.name,
+                "cards": chapter_cards,
+                "vocab_keys": sum(len(vocab.keys) for vocab in chapter.vocab),
+                "templates": templates,
+            }
+        )
+        total += chapter_cards
+    return {
+        "cards": total,
+        "budget": budget,
+        "over_budget": over_budget,
+        "chapters": chapters,
+    }
@@ -0,0 +1,292 @@
+import os
+import sys
+import copy
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from lacu_parse import Parser, parse_file_lines
+from lacu_files import MANIFEST_NAME
+
+
+class BatchDeck:
+    def __init__(self, primary_file, prior_files):
+        self.primary_file = primary_file
+        self.prior_files = prior_files
+
+
+class ChainNode:
+    # one file in the prefix tree of -f chains. Decks whose chain ends here are
+    # reported from the parser state after this file has been parsed.
+    def __init__(self, file_str):
+        self.file_str = file_str
+        self.children = {}
+        self.decks = []
+
+
+class DeckResult:
+    def __init__(self, deck, issues, infos, blocked_by=None, output_file=None):
+        self.primary_file = deck.primary_file
+        self.prior_files = deck.prior_files
+        self.issues = issues
+        self.infos = infos
+        self.blocked_by = blocked_by
+        self.output_file = output_file
+
+
+def load_manifest(path):
+    # a manifest lists each deck with its chain of prior files, relative to the
+    # manifest. A directory without one is treated as a set of standalone decks.
+    if os.path.isdir(path):
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return [
+                BatchDeck(os.path.join(path, name), [])
+                for name in sorted(os.listdir(path))
+                if name.endswith(".md")
+            ]
+        path = manifest_path
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, "r") as file:
+        manifest = json.load(file)
+
+    decks = []
+    for entry in manifest["decks"]:
+        decks.append(
+            BatchDeck(
+                os.path.join(base_dir, entry["file"]),
+                [os.path.join(base_dir, f) for f in entry.get("prior_files", [])],
+            )
+        )
+    return decks
+
+
+def build_chain_tree(decks):
+    root = ChainNode(None)
+    for deck in decks:
+        node = root
+        for file_str in deck.prior_files + [deck.primary_file]:
+            key = os.path.normpath(file_str)
+            if key not in node.children:
+                node.children[key] = ChainNode(file_str)
+            node = node.children[key]
+        node.decks.append(deck)
+    return root
+
+
+def collect_decks(node):
+    decks = list(node.decks)
+    for child in node.children.values():
+        decks.extend(collect_decks(child))
+    return decks
+
+
+def output_path(output_dir, deck):
+    # decks sharing a file name but not a chain must not share an output file
+    chain = [os.path.normpath(f) for f in deck.prior_files + [deck.primary_file]]
+    digest = hashlib.sha256("\n".join(chain).encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(deck.primary_file))[0]
+    return os.path.join(output_dir, f"{name}-{digest}.json")
+
+
+def parse_node(lacparser: Parser, node, output_dir=None):
+    parse_file_lines(lacparser, node.file_str, False)
+
+    results = []
+    for deck in node.decks:
+        output_file = None
+        if output_dir:
+            output_file = output_path(output_dir, deck)
+            with open(output_file, "w") as file:
+                lacparser.print_json(file=file)
+        results.append(
+            DeckResult(
+                deck, list(lacparser.issues), list(lacparser.infos), None, output_file
+            )
+        )
+
+    # dependents are blocked by any issue, as with a single -f chain
+    if lacparser.issues:
+        for child in node.children.values():
+            for deck in collect_decks(child):
+                results.append(DeckResult(deck, [], [], node.file_str))
+    return results
+
+
+def run_node(lacparser: Parser, node, output_dir=None):
+    results = parse_node(lacparser, node, output_dir)
+    if not lacparser.issues:
+        results.extend(run_children(lacparser, node, output_dir))
+    return results
+
+
+def run_children(lacparser: Parser, node, output_dir=None):
+    results = []
+    children = list(node.children.values())
+    for count, child in enumerate(children):
+        # the last dependent can take over the shared state instead of a copy
+        if count < len(children) - 1:
+            child_parser = copy.deepcopy(lacparser)
+        else:
+            child_parser = lacparser
+        results.extend(run_node(child_parser, child, output_dir))
+    return results
+
+
+def run_segment(lacparser: Parser, node, output_dir=None):
+    # parses down from node until the chain forks, and hands the state at the
+    # fork back so each branch can be scheduled on its own
+    results = parse_node(lacparser, node, output_dir)
+    while not lacparser.issues and len(node.children) == 1:
+        node = next(iter(node.children.values()))
+        results.extend(parse_node(lacparser, node, output_dir))
+    if lacparser.issues or not node.children:
+        return results, None, []
+    return results, lacparser, list(node.children.values())
+
+
+def run_forks(executor, lacparser: Parser, children, output_dir=None):
+    # every fork in the tree submits its branches to the pool, each with a
+    # pickled copy of the state at the fork
+    results = []
+    pending = {
+        executor.submit(run_segment, lacparser, child, output_dir) for child in children
+    }
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            segment_results, fork_parser, fork_children = future.result()
+            results.extend(segment_results)
+            for child in fork_children:
+                pending.add(
+                    executor.submit(run_segment, fork_parser, child, output_dir)
+                )
+    return results
+
+
+def run_batch(decks, jobs=1, output_dir=None, debug=False):
+    root = build_chain_tree(decks)
+    lacparser = Parser()
+    lacparser.debug = debug
+
+    # parse the prefix shared by every deck once, up to the first branch
+    results = []
+    node = root
+    while len(node.children) == 1:
+        node = next(iter(node.children.values()))
+        results.extend(parse_node(lacparser, node, output_dir))
+        if lacparser.issues:
+            return order_results(decks, results)
+
+    children = list(node.children.values())
+    if jobs > 1 and len(children) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results.extend(run_forks(executor, lacparser, children, output_dir))
+    else:
+        results.extend(run_children(lacparser, node, output_dir))
+    return order_results(decks, results)
+
+
+def order_results(decks, results):
+    by_deck = {}
+    for result in results:
+        key = (result.primary_file, tuple(result.prior_files))
+        by_deck[key] = result
+    ordered = []
+    for deck in decks:
+        key = (deck.primary_file, tuple(deck.prior_files))
+        if key in by_deck:
+            ordered.append(by_deck.pop(key))
+    return ordered
+
+
+def print_report(results, list_infos=False):
+    for result in results:
+        print(f"DECK: {result.primary_file}")
+        if result.prior_files:
+            print(f"PRIOR FILES: {' '.join(result.prior_files)}")
+        if result.blocked_by:
+            print(f"Error: precedent file {result.blocked_by} contains issues")
+        if result.issues:
+            print("ISSUES:")
+        for issue in result.issues:
+            print(issue)
+        if list_infos:
+            print("INFO:")
+            for info in result.infos:
+                print(info)
+        if result.output_file:
+            print(f"OUTPUT: {result.output_file}")
+        print()
+
+    failed = [r for r in results if r.issues or r.blocked_by]
+    print(f"{len(results)} decks parsed, {len(failed)} with issues")
+
+
+def write_report(results, report_file):
+    report = {
+        "decks": [
+            {
+                "file": r.primary_file,
+                "prior_files": r.prior_files,
+                "blocked_by": r.blocked_by,
+                "issues": r.issues,
+                "infos": r.infos,
+                "output_file": r.output_file,
+            }
+            for r in results
+        ]
+    }
+    with open(report_file, "w") as file:
+        json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Lacuna Batch Parser")
+    argparser.add_argument(
+        "manifest",
+        metavar="MANIFEST",
+        help=f"Manifest of decks and their prior files, or a directory of decks "
+        f"(using its {MANIFEST_NAME}, if present)",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes used for independent deck chains",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output-dir",
+        metavar="DIR",
+        help="Write the JSON output of each deck into this directory",
+    )
+    argparser.add_argument(
+        "-r",
+        "--report",
+        metavar="REPORT_FILE",
+        help="Also write the combined report to a JSON file",
+    )
+    argparser.add_argument(
+        "-d", "--debug", action="store_true", help="Print debug information"
+    )
+    argparser.add_argument(
+        "-l",
+        "--list-infos",
+        action="store_true",
+        help="Show additional information about deck redundancy",
+    )
+
+    args = argparser.parse_args()
+    decks = load_manifest(args.manifest)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = run_batch(decks, args.jobs, args.output_dir, args.debug)
+    print_report(results, args.list_infos)
+    if args.report:
+        write_report(results, args.report)
+    if any(r.issues or r.blocked_by for r in results):
+        sys.exit(1)
@@ -0,0 +1,574 @@
+import sys
+import json
+import mmap
+import array
+import struct
+
+from lacu_tokens import tokenize_side
+
+# Binary columnar deck format. All integers are little-endian uint32.
+#
+#   header         MAGIC, FORMAT_VERSION, then the HEADER fields below
+#   string offsets num_strings + 1 byte offsets into the string data
+#   string data    UTF-8 text of every distinct string
+#   heap           uint32 words holding the fixed-width record tables and the
+#                  arrays they point to, addressed by word offset
+#
+# Record tables in the heap:
+#   category   name, num_variants, num_selectables, data
+#              data: variant name ids, then one column of num_selectables
+#              string ids per variant
+#   group      name, category_name, key_variant, num_keys, keys
+#   pair group name, num_columns, num_pairs, valid, data, category_checking
+#              data: column names, column types, then the pairs row by row
+#   chapter    name, num_columns, column_variants, forced_first_side,
+#              num_templates, templates, num_vocab, vocab
+#   template   num_sides, sides -> side records of (text, num_tokens, tokens)
+#   token      kind, a, b, c (see TOKEN_*)
+#   vocab      category_name, key_variant, num_keys, keys
+#
+# A name of NONE marks a null entry in the deck's lists.
+
+MAGIC = b"LACB"
+FORMAT_VERSION = 1
+NONE = 0xFFFFFFFF
+HEADER = struct.Struct("<4s17I")
+HEADER_FIELDS = [
+    "version",
+    "num_strings",
+    "string_offsets",
+    "string_data",
+    "string_data_length",
+    "heap",
+    "heap_length",
+    "num_categories",
+    "categories",
+    "num_groups",
+    "groups",
+    "num_pair_groups",
+    "pair_groups",
+    "num_chapters",
+    "chapters",
+    "reserved_0",
+    "reserved_1",
+]
+
+CATEGORY_WORDS = 4
+GROUP_WORDS = 5
+PAIR_GROUP_WORDS = 6
+CHAPTER_WORDS = 8
+TEMPLATE_WORDS = 2
+SIDE_WORDS = 3
+TOKEN_WORDS = 4
+VOCAB_WORDS = 4
+
+# literal: a = text; group: a = group, b = variant;
+# pair: a = pair group, b = alias, c = variant
+TOKEN_LITERAL = 0
+TOKEN_GROUP = 1
+TOKEN_PAIR = 2
+TOKEN_EXPLICIT = 0x10
+
+
+class StringTable:
+    def __init__(self):
+        self.ids = {}
+
+    def id(self, string):
+        if string is None:
+            return NONE
+        if string not in self.ids:
+            self.ids[string] = len(self.ids)
+        return self.ids[string]
+
+    def ids_of(self, strings):
+        return [self.id(string) for string in strings]
+
+
+class Heap:
+    def __init__(self):
+        self.words = array.array("I")
+
+    def reserve(self, num_words):
+        offset = len(self.words)
+        self.words.extend([0] * num_words)
+        return offset
+
+    def extend(self, values):
+        offset = len(self.words)
+        self.words.extend(values)
+        return offset
+
+
+def encode_token(strings, token):
+    if token["type"] == "literal":
+        return [TOKEN_LITERAL, strings.id(token["text"]), NONE, NONE]
+    kind = TOKEN_GROUP if token["type"] == "group" else TOKEN_PAIR
+    if token["explicit"]:
+        kind |= TOKEN_EXPLICIT
+    if token["type"] == "group":
+        return [kind, strings.id(token["group"]), strings.id(token["variant"]), NONE]
+    return [
+        kind,
+        strings.id(token["pair_group"]),
+        strings.id(token["alias"]),
+        strings.id(token["variant"]),
+    ]
+
+
+def encode_chapter(heap, strings, chapter):
+    # tables are reserved first, so each chapter's records stay contiguous
+    templates = heap.reserve(len(chapter.templates) * TEMPLATE_WORDS)
+    for count, template in enumerate(chapter.templates):
+        sides = heap.reserve(len(template.sides) * SIDE_WORDS)
+        for side_count, side in enumerate(template.sides):
+            tokens = tokenize_side(side, chapter.column_variants[side_count])
+            words = []
+            for token in tokens:
+                words.extend(encode_token(strings, token))
+            record = [strings.id(side), len(tokens), heap.extend(words)]
+            start = sides + side_count * SIDE_WORDS
+            heap.words[start : start + SIDE_WORDS] = array.array("I", record)
+        record = [len(template.sides), sides]
+        start = templates + count * TEMPLATE_WORDS
+        heap.words[start : start + TEMPLATE_WORDS] = array.array("I", record)
+
+    vocab_table = heap.reserve(len(chapter.vocab) * VOCAB_WORDS)
+    for count, vocab in enumerate(chapter.vocab):
+        record = [
+            strings.id(vocab.category_name),
+            strings.id(vocab.key_variant_name),
+            len(vocab.keys),
+            heap.extend(strings.ids_of(vocab.keys)),
+        ]
+        start = vocab_table + count * VOCAB_WORDS
+        heap.words[start : start + VOCAB_WORDS] = array.array("I", record)
+
+    return [
+        strings.id(chapter.name),
+        len(chapter.column_variants),
+        heap.extend(strings.ids_of(chapter.column_variants)),
+        chapter.forced_first_side,
+        len(chapter.templates),
+        templates,
+        len(chapter.vocab),
+        vocab_table,
+    ]
+
+
+def encode_table(heap, records, record_words):
+    offset = heap.reserve(len(records) * record_words)
+    for count, record in enumerate(records):
+        start = offset + count * record_words
+        heap.words[start : start + record_words] = array.array("I", record)
+    return offset
+
+
+def write_binary(deck, path):
+    strings = StringTable()
+    heap = Heap()
+
+    category_records = []
+    for category in deck.categories:
+        words = strings.ids_of(category.variant_names)
+        for count in range(len(category.variant_names)):
+            words.extend(
+                strings.ids_of(s.variants[count] for s in category.selectables)
+            )
+        category_records.append(
+            [
+                strings.id(category.name),
+                len(category.variant_names),
+                len(category.selectables),
+                heap.extend(words),
+            ]
+        )
+
+    group_records = []
+    for group in deck.groups:
+        group_records.append(
+            [
+                strings.id(group.name),
+                strings.id(group.category_name),
+                strings.id(group.key_variant_name),
+                len(group.keys),
+                heap.extend(strings.ids_of(group.keys)),
+            ]
+        )
+
+    pair_group_records = []
+    for pair_group in deck.pair_groups:
+        if not pair_group:
+            pair_group_records.append([NONE, 0, 0, 0, 0, 0])
+            continue
+        words = strings.ids_of(pair_group.column_names)
+        words.extend(strings.ids_of(pair_group.column_types))
+        num_columns = len(pair_group.column_names)
+        for pair in pair_group.pairs:
+            # rows are fixed width; a pair with the wrong column count has
+            # already been reported as an issue
+            row = list(pair[:num_columns]) + [None] * (num_columns - len(pair))
+            words.extend(strings.ids_of(row))
+        pair_group_records.append(
+            [
+                strings.id(pair_group.name),
+                len(pair_group.column_names),
+                len(pair_group.pairs),
+                int(pair_group.valid),
+                heap.extend(words),
+                heap.extend(strings.ids_of(pair_group.category_checking)),
+            ]
+        )
+
+    chapter_records = []
+    for chapter in deck.chapters:
+        if not chapter:
+            chapter_records.append([NONE, 0, 0, 0, 0, 0, 0, 0])
+            continue
+        chapter_records.append(encode_chapter(heap, strings, chapter))
+
+    header = {
+        "version": FORMAT_VERSION,
+        "num_categories": len(category_records),
+        "categories": encode_table(heap, category_records, CATEGORY_WORDS),
+        "num_groups": len(group_records),
+        "groups": encode_table(heap, group_records, GROUP_WORDS),
+        "num_pair_groups": len(pair_group_records),
+        "pair_groups": encode_table(heap, pair_group_records, PAIR_GROUP_WORDS),
+        "num_chapters": len(chapter_records),
+        "chapters": encode_table(heap, chapter_records, CHAPTER_WORDS),
+    }
+
+    string_offsets = array.array("I", [0])
+    string_data = bytearray()
+    for string in strings.ids:
+        string_data += string.encode("utf-8")
+        string_offsets.append(len(string_data))
+    # keep the heap word aligned in the file
+    string_data += b"\0" * (-len(string_data) % 4)
+
+    header["num_strings"] = len(strings.ids)
+    header["string_offsets"] = HEADER.size
+    header["string_data"] = HEADER.size + len(string_offsets) * 4
+    header["string_data_length"] = string_offsets[-1]
+    header["heap"] = header["string_data"] + len(string_data)
+    header["heap_length"] = len(heap.words)
+
+    if sys.byteorder == "big":
+        string_offsets.byteswap()
+        heap.words.byteswap()
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, *[header.get(f, 0) for f in HEADER_FIELDS]))
+        file.write(string_offsets.tobytes())
+        file.write(string_data)
+        file.write(heap.words.tobytes())
+
+
+def uint32_view(buffer):
+    if sys.byteorder == "little":
+        return buffer.cast("I")
+    # big-endian hosts pay for a copy; the file layout stays the same
+    words = array.array("I", bytes(buffer))
+    words.byteswap()
+    return words
+
+
+class BinaryDeck:
+    # Opens a deck written by write_binary. The file is mmapped and every view
+    # reads straight from the mapped pages, decoding strings only on access, so
+    # opening is constant time and worker processes share one copy of the deck.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.mmap, 0)
+        if fields[0] != MAGIC:
+            raise ValueError(f"'{path}' is not a binary Lacuna deck")
+        self.header = dict(zip(HEADER_FIELDS, fields[1:]))
+        if self.header["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported deck format version {self.header['version']}"
+            )
+
+        buffer = memoryview(self.mmap)
+        start = self.header["string_offsets"]
+        self.string_offsets = uint32_view(
+            buffer[start : start + (self.header["num_strings"] + 1) * 4]
+        )
+        start = self.header["string_data"]
+        self.string_data = buffer[start : start + self.header["string_data_length"]]
+        start = self.header["heap"]
+        self.words = uint32_view(buffer[start : start + self.header["heap_length"] * 4])
+        self.buffer = buffer
+
+        self.categories = RecordList(self, "categories", CATEGORY_WORDS, CategoryView)
+        self.groups = RecordList(self, "groups", GROUP_WORDS, GroupView)
+        self.pair_groups = RecordList(
+            self, "pair_groups", PAIR_GROUP_WORDS, PairGroupView
+        )
+        self.chapters = RecordList(self, "chapters", CHAPTER_WORDS, ChapterView)
+
+    def string(self, string_id):
+        if string_id == NONE:
+            return None
+        start = self.string_offsets[string_id]
+        end = self.string_offsets[string_id + 1]
+        return str(self.string_data[start:end], "utf-8")
+
+    def strings(self, offset, length):
+        return StringColumn(self, offset, length)
+
+    def to_dict(self):
+        # the same structure Parser.print_json writes
+        return {
+            "categories": [c.to_dict() for c in self.categories],
+            "groups": [g.to_dict() for g in self.groups],
+            "pair_groups": [pg.to_dict() if pg else None for pg in self.pair_groups],
+            "chapters": [c.to_dict() if c else None for c in self.chapters],
+        }
+
+    def close(self):
+        for view in (self.string_offsets, self.string_data, self.words, self.buffer):
+            if isinstance(view, memoryview):
+                view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # views handed out are still alive; the mapping goes away with them
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordList:
+    # a lazily decoded list of fixed-width records in the heap
+    def __init__(self, deck, table, record_words, view_class, offset=None, length=None):
+        self.deck = deck
+        self.record_words = record_words
+        self.view_class = view_class
+        if offset is None:
+            offset = deck.header[table]
+            length = deck.header["num_" + table]
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("record index out of range")
+        start = self.offset + index * self.record_words
+        record = self.deck.words[start : start + self.record_words]
+        if record[0] == NONE:
+            return None
+        return self.view_class(self.deck, record)
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+
+class StringColumn:
+    # a fixed-width array of string ids, decoded per item
+    def __init__(self, deck, offset, length):
+        self.deck = deck
+        self.ids = deck.words[offset : offset + length]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.deck.string(i) for i in self.ids[index]]
+        return self.deck.string(self.ids[index])
+
+    def __iter__(self):
+        for string_id in self.ids:
+            yield self.deck.string(string_id)
+
+    def index(self, string):
+        for count, value in enumerate(self):
+            if value == string:
+                return count
+        raise ValueError(f"'{string}' is not in column")
+
+
+class CategoryView:
+    def __init__(self, deck, record):
+        self.deck = deck
+        name, self.num_variants, self.num_selectables, self.data = record
+        self.name = deck.string(name)
+        self.variant_names = deck.strings(self.data, self.num_variants)
+
+    def column(self, variant):
+        # the values of every selectable for one variant, by name or index
+        if isinstance(variant, str):
+            variant = self.variant_names.index(variant)
+        start = self.data + self.num_variants + variant * self.num_selectables
+        return self.deck.strings(start, self.num_selectables)
+
+    def selectable(self, index):
+        return [self.column(v)[index] for v in range(self.num_variants)]
+
+    def to_dict(self):
+        columns = [list(self.column(v)) for v in range(self.num_variants)]
+        return {
+            "name": self.name,
+            "variant_names": list(self.variant_names),
+            "num_variants": self.num_variants,
+            "selectables": [{"variants": list(row)} for row in zip(*columns)],
+        }
+
+
+class GroupView:
+    def __init__(self, deck, record):
+        name, category_name, key_variant, num_keys, keys = record
+        self.name = deck.string(name)
+        self.category_name = deck.string(category_name)
+        self.key_variant_name = deck.string(key_variant)
+        self.keys = deck.strings(keys, num_keys)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "category_name": self.category_name,
+            "key_variant_name": self.key_variant_name,
+            "keys": list(self.keys),
+        }
+
+
+class PairGroupView:
+    def __init__(self, deck, record):
+        self.deck = deck
+        name, self.num_columns, self.num_pairs, valid, self.data, checking = record
+        self.name = deck.string(name)
+        self.valid = bool(valid)
+        self.column_names = deck.strings(self.data, self.num_columns)
+        self.column_types = deck.strings(self.data + self.num_columns, self.num_columns)
+        self.category_checking = deck.strings(checking, self.num_columns)
+
+    def pair(self, index):
+        start = self.data + (2 + index) * self.num_columns
+        return list(self.deck.strings(start, self.num_columns))
+
+    @property
+    def pairs(self):
+        return [self.pair(index) for index in range(self.num_pairs)]
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "column_names": list(self.column_names),
+            "column_types": list(self.column_types),
+            "category_checking": list(self.category_checking),
+            "pairs": self.pairs,
+            "valid": self.valid,
+        }
+
+
+class ChapterView:
+    def __init__(self, deck, record):
+        self.deck = deck
+        name, num_columns, columns, self.forced_first_side = record[:4]
+        num_templates, templates, num_vocab, vocab = record[4:]
+        self.name = deck.string(name)
+        self.column_variants = deck.strings(columns, num_columns)
+        self.templates = RecordList(
+            deck, None, TEMPLATE_WORDS, TemplateView, templates, num_templates
+        )
+        self.vocab = RecordList(deck, None, VOCAB_WORDS, VocabView, vocab, num_vocab)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "column_variants": list(self.column_variants),
+            "forced_first_side": self.forced_first_side,
+            "templates": [t.to_dict() for t in self.templates],
+            "vocab": [v.to_dict() for v in self.vocab],
+        }
+
+
+class TemplateView:
+    def __init__(self, deck, record):
+        self.deck = deck
+        self.num_sides, self.sides_offset = record
+
+    def side_record(self, index):
+        start = self.sides_offset + index * SIDE_WORDS
+        return self.deck.words[start : start + SIDE_WORDS]
+
+    @property
+    def sides(self):
+        return [self.deck.string(self.side_record(i)[0]) for i in range(self.num_sides)]
+
+    def token_words(self, index):
+        # the raw token stream of a side, TOKEN_WORDS words per token
+        _, num_tokens, tokens = self.side_record(index)
+        return self.deck.words[tokens : tokens + num_tokens * TOKEN_WORDS]
+
+    def tokens(self, index):
+        words = self.token_words(index)
+        string = self.deck.string
+        tokens = []
+        for start in range(0, len(words), TOKEN_WORDS):
+            kind, a, b, c = words[start : start + TOKEN_WORDS]
+            explicit = bool(kind & TOKEN_EXPLICIT)
+            kind &= ~TOKEN_EXPLICIT
+            if kind == TOKEN_LITERAL:
+                tokens.append({"type": "literal", "text": string(a)})
+            elif kind == TOKEN_GROUP:
+                tokens.append(
+                    {
+                        "type": "group",
+                        "group": string(a),
+                        "variant": string(b),
+                        "explicit": explicit,
+                    }
+                )
+            else:
+                tokens.append(
+                    {
+                        "type": "pair",
+                        "pair_group": string(a),
+                        "alias": string(b),
+                        "variant": string(c),
+                        "explicit": explicit,
+                    }
+                )
+        return tokens
+
+    def to_dict(self):
+        return {"sides": self.sides}
+
+
+class VocabView:
+    def __init__(self, deck, record):
+        category_name, key_variant, num_keys, keys = record
+        self.name = "vocab"
+        self.category_name = deck.string(category_name)
+        self.key_variant_name = deck.string(key_variant)
+        self.keys = deck.strings(keys, num_keys)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "category_name": self.category_name,
+            "key_variant_name": self.key_variant_name,
+            "keys": list(self.keys),
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python lacu_binary.py <binary_deck_file>")
+        sys.exit(1)
+
+    with BinaryDeck(sys.argv[1]) as deck:
+        print(json.dumps(deck.to_dict(), indent=4))
@@ -0,0 +1,13 @@
+import hashlib
+
+# name of the index file in batch deck directories and shard directories
+MANIFEST_NAME = "manifest.json"
+
+
+def file_sha256(path):
+    # hashed in blocks, so large decks and outputs are never read whole
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
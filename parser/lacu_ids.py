@@ -0,0 +1,400 @@
+import sys
+import json
+
+from lacu_tokens import tokenize_side, render_side
+
+# In the ID-normalized form every category, group and pair group is referred
+# to by its index in the deck, and every variant and selectable by its index in
+# its category. References that could not be resolved keep their string.
+#
+# Template sides become token lists: a literal is a string, a group reference
+# is [group, variant, explicit] and a pair group reference is
+# [pair_group, column, variant, explicit].
+
+FORMAT_VERSION = 1
+
+
+class DeckIds:
+    def __init__(self, deck):
+        self.categories = index_by_name(deck.categories)
+        self.groups = index_by_name(deck.groups)
+        self.pair_groups = index_by_name(deck.pair_groups)
+        self.deck = deck
+        self.selectable_indexes = {}
+
+    def category(self, name):
+        return self.categories.get(name, name)
+
+    def variant(self, category_id, variant_name):
+        if not isinstance(category_id, int):
+            return variant_name
+        variant_names = self.deck.categories[category_id].variant_names
+        if variant_name in variant_names:
+            return variant_names.index(variant_name)
+        return variant_name
+
+    def selectable(self, category_id, variant_id, value):
+        if not isinstance(category_id, int) or not isinstance(variant_id, int):
+            return value
+        key = (category_id, variant_id)
+        if key not in self.selectable_indexes:
+            # first match wins, as in the parser's own lookups
+            index = {}
+            selectables = self.deck.categories[category_id].selectables
+            for count, selectable in enumerate(selectables):
+                index.setdefault(selectable.variants[variant_id], count)
+            self.selectable_indexes[key] = index
+        return self.selectable_indexes[key].get(value, value)
+
+    def group_category(self, group_id):
+        if not isinstance(group_id, int):
+            return None
+        return self.category(self.deck.groups[group_id].category_name)
+
+    def column_category(self, pair_group, column):
+        type = pair_group.column_types[column].split(":")
+        if type[0] == "selectable" and len(type) > 2:
+            category_id = self.category(type[1])
+            return category_id, self.variant(category_id, type[2])
+        if type[0] == "group" and pair_group.pairs:
+            group_id = self.groups.get(pair_group.pairs[0][column])
+            return self.group_category(group_id), None
+        return None, None
+
+
+def index_by_name(objects):
+    index = {}
+    for count, obj in enumerate(objects):
+        if obj:
+            index.setdefault(obj.name, count)
+    return index
+
+
+def normalize_group_keys(ids, category_name, key_variant, keys):
+    category_id = ids.category(category_name)
+    variant_id = ids.variant(category_id, key_variant)
+    return {
+        "category": category_id,
+        "key_variant": variant_id,
+        "keys": [ids.selectable(category_id, variant_id, key) for key in keys],
+    }
+
+
+def normalize_pair_group(ids, pair_group):
+    columns = []
+    for count, type in enumerate(pair_group.column_types):
+        if type.split(":")[0] == "group":
+            columns.append(None)
+        else:
+            columns.append(ids.column_category(pair_group, count))
+    pairs = []
+    for pair in pair_group.pairs:
+        members = []
+        for count, member in enumerate(pair):
+            if count < len(columns) and columns[count]:
+                members.append(ids.selectable(*columns[count], member))
+            else:
+                members.append(ids.groups.get(member, member))
+        pairs.append(members)
+    return {
+        "name": pair_group.name,
+        "column_names": pair_group.column_names,
+        "column_types": pair_group.column_types,
+        "category_checking": [
+            ids.category(name) if name else None
+            for name in pair_group.category_checking
+        ],
+        "pairs": pairs,
+        "valid": pair_group.valid,
+    }
+
+
+def normalize_token(ids, token):
+    if token["type"] == "literal":
+        return token["text"]
+    explicit = int(token["explicit"])
+    if token["type"] == "group":
+        group_id = ids.groups.get(token["group"], token["group"])
+        category_id = ids.group_category(group_id)
+        return [group_id, ids.variant(category_id, token["variant"]), explicit]
+
+    pg_id = ids.pair_groups.get(token["pair_group"], token["pair_group"])
+    column = token["alias"]
+    category_id = None
+    if isinstance(pg_id, int):
+        pair_group = ids.deck.pair_groups[pg_id]
+        if column in pair_group.column_names:
+            column = pair_group.column_names.index(column)
+            category_id = ids.column_category(pair_group, column)[0]
+    return [pg_id, column, ids.variant(category_id, token["variant"]), explicit]
+
+
+def normalize_chapter(ids, chapter):
+    templates = []
+    for template in chapter.templates:
+        sides = []
+        for count, side in enumerate(template.sides):
+            tokens = tokenize_side(side, chapter.column_variants[count])
+            sides.append([normalize_token(ids, token) for token in tokens])
+        templates.append(sides)
+    return {
+        "name": chapter.name,
+        "column_variants": chapter.column_variants,
+        "forced_first_side": chapter.forced_first_side,
+        "templates": templates,
+        "vocab": [
+            normalize_group_keys(
+                ids, vocab.category_name, vocab.key_variant_name, vocab.keys
+            )
+            for vocab in chapter.vocab
+        ],
+    }
+
+
+def normalize_deck(deck):
+    ids = DeckIds(deck)
+    normalized = normalize_symbols(ids)
+    normalized["chapters"] = [
+        normalize_chapter(ids, chapter) if chapter else None
+        for chapter in deck.chapters
+    ]
+    return normalized
+
+
+def normalize_symbols(ids):
+    # everything but the chapters
+    deck = ids.deck
+    groups = []
+    for group in deck.groups:
+        normalized = {"name": group.name}
+        normalized.update(
+            normalize_group_keys(
+                ids, group.category_name, group.key_variant_name, group.keys
+            )
+        )
+        groups.append(normalized)
+    return {
+        "format_version": FORMAT_VERSION,
+        "categories": [
+            {
+                "name": category.name,
+                "variant_names": category.variant_names,
+                "selectables": [s.variants for s in category.selectables],
+            }
+            for category in deck.categories
+        ],
+        "groups": groups,
+        "pair_groups": [
+            normalize_pair_group(ids, pg) if pg else None for pg in deck.pair_groups
+        ],
+    }
+
+
+class DeckNames:
+    # reverse lookups for expand_deck; strings pass through unchanged
+    def __init__(self, data):
+        self.data = data
+        self.category_ids = {}
+        for count, category in enumerate(data["categories"]):
+            self.category_ids.setdefault(category["name"], count)
+
+    def category(self, category_id):
+        if isinstance(category_id, int):
+            return self.data["categories"][category_id]
+        return None
+
+    def category_name(self, category_id):
+        category = self.category(category_id)
+        return category["name"] if category else category_id
+
+    def variant_name(self, category_id, variant_id):
+        category = self.category(category_id)
+        if category and isinstance(variant_id, int):
+            return category["variant_names"][variant_id]
+        return variant_id
+
+    def selectable_value(self, category_id, variant_id, selectable_id):
+        category = self.category(category_id)
+        if category and isinstance(variant_id, int) and isinstance(selectable_id, int):
+            return category["selectables"][selectable_id][variant_id]
+        return selectable_id
+
+    def group_name(self, group_id):
+        if isinstance(group_id, int):
+            return self.data["groups"][group_id]["name"]
+        return group_id
+
+    def group_category(self, group_id):
+        if isinstance(group_id, int):
+            return self.data["groups"][group_id]["category"]
+        return None
+
+    def pair_column_category(self, pair_group, column):
+        type = pair_group["column_types"][column].split(":")
+        if type[0] == "selectable" and len(type) > 2:
+            category_id = self.category_id(type[1])
+            return category_id, self.variant_id(category_id, type[2])
+        if type[0] == "group" and pair_group["pairs"]:
+            return self.group_category(pair_group["pairs"][0][column]), None
+        return None, None
+
+    def category_id(self, name):
+        return self.category_ids.get(name, name)
+
+    def variant_id(self, category_id, name):
+        category = self.category(category_id)
+        if category and name in category["variant_names"]:
+            return category["variant_names"].index(name)
+        return name
+
+
+def expand_group_keys(names, name, data):
+    category_id = data["category"]
+    variant_id = data["key_variant"]
+    return {
+        "name": name,
+        "category_name": names.category_name(category_id),
+        "key_variant_name": names.variant_name(category_id, variant_id),
+        "keys": [
+            names.selectable_value(category_id, variant_id, key) for key in data["keys"]
+        ],
+    }
+
+
+def expand_pair_group(names, pair_group):
+    columns = []
+    for count, type in enumerate(pair_group["column_types"]):
+        if type.split(":")[0] == "group":
+            columns.append(None)
+        else:
+            columns.append(names.pair_column_category(pair_group, count))
+    pairs = []
+    for pair in pair_group["pairs"]:
+        members = []
+        for count, member in enumerate(pair):
+            if count < len(columns) and columns[count]:
+                members.append(names.selectable_value(*columns[count], member))
+            else:
+                members.append(names.group_name(member))
+        pairs.append(members)
+    return {
+        "name": pair_group["name"],
+        "column_names": pair_group["column_names"],
+        "column_types": pair_group["column_types"],
+        "category_checking": [
+            names.category_name(c) if c is not None else None
+            for c in pair_group["category_checking"]
+        ],
+        "pairs": pairs,
+        "valid": pair_group["valid"],
+    }
+
+
+def expand_token(names, token):
+    if isinstance(token, str):
+        return {"type": "literal", "text": token}
+    if len(token) == 3:
+        group_id, variant, explicit = token
+        category_id = names.group_category(group_id)
+        return {
+            "type": "group",
+            "group": names.group_name(group_id),
+            "variant": names.variant_name(category_id, variant),
+            "explicit": bool(explicit),
+        }
+
+    pg_id, column, variant, explicit = token
+    alias = column
+    category_id = None
+    if isinstance(pg_id, int):
+        pair_group = names.data["pair_groups"][pg_id]
+        pg_name = pair_group["name"]
+        if isinstance(column, int):
+            alias = pair_group["column_names"][column]
+            category_id = names.pair_column_category(pair_group, column)[0]
+    else:
+        pg_name = pg_id
+    return {
+        "type": "pair",
+        "pair_group": pg_name,
+        "alias": alias,
+        "variant": names.variant_name(category_id, variant),
+        "explicit": bool(explicit),
+    }
+
+
+def expand_deck(data, template_output="sides"):
+    # rebuilds the string form written by Parser.print_json
+    names = DeckNames(data)
+    chapters = []
+    for chapter in data["chapters"]:
+        if not chapter:
+            chapters.append(None)
+            continue
+        templates = []
+        for template in chapter["templates"]:
+            tokens = [[expand_token(names, t) for t in side] for side in template]
+            expanded = {}
+            if template_output != "tokens":
+                expanded["sides"] = [render_side(side) for side in tokens]
+            if template_output != "sides":
+                expanded["tokens"] = tokens
+            templates.append(expanded)
+        chapters.append(
+            {
+                "name": chapter["name"],
+                "column_variants": chapter["column_variants"],
+                "forced_first_side": chapter["forced_first_side"],
+                "templates": templates,
+                "vocab": [
+                    expand_group_keys(names, "vocab", vocab)
+                    for vocab in chapter["vocab"]
+                ],
+            }
+        )
+    return {
+        "categories": [
+            {
+                "name": category["name"],
+                "variant_names": category["variant_names"],
+                "num_variants": len(category["variant_names"]),
+                "selectables": [
+                    {"variants": variants} for variants in category["selectables"]
+                ],
+            }
+            for category in data["categories"]
+        ],
+        "groups": [
+            expand_group_keys(names, group["name"], group) for group in data["groups"]
+        ],
+        "pair_groups": [
+            expand_pair_group(names, pg) if pg else None for pg in data["pair_groups"]
+        ],
+        "chapters": chapters,
+    }
+
+
+def print_ids(deck, file=None):
+    # written chapter by chapter, so spilled chapters are streamed from disk.
+    # Output matches json.dumps(normalize_deck(deck)) with compact separators.
+    if file is None:
+        file = sys.stdout
+    ids = DeckIds(deck)
+    json_data = json.dumps(normalize_symbols(ids), separators=(",", ":"))
+    file.write(json_data[:-1] + ',"chapters":[')
+    for count, chapter in enumerate(deck.chapters):
+        if count:
+            file.write(",")
+        normalized = normalize_chapter(ids, chapter) if chapter else None
+        file.write(json.dumps(normalized, separators=(",", ":")))
+    file.write("]}\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python lacu_ids.py <id_normalized_json_file>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r") as file:
+        data = json.load(file)
+    print(json.dumps(expand_deck(data), indent=4))
@@ -1,9 +1,22 @@
 import json
 import csv
 import sys
-import re
+import os
+import atexit
+import pickle
+import shutil
+import tempfile
 import argparse
 import traceback
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from lacu_analyze import find_duplicates, count_cards, write_report
+from lacu_sqlite import write_sqlite
+from lacu_shards import write_shards
+from lacu_tokens import tokenize_side
+from lacu_ids import print_ids
+from lacu_binary import write_binary
 
 
 class ParsedDeck:
@@ -14,6 +27,40 @@ class ParsedDeck:
         self.chapters = []
 
 
+class ChapterStore:
+    # Stand-in for ParsedDeck.chapters in low memory mode. Finished chapters are
+    # pickled to a temporary directory and only loaded again one at a time.
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix="lacuna-", dir=directory)
+        self.num_chapters = 0
+
+    def chapter_path(self, index):
+        return os.path.join(self.directory, f"{index:06d}.pickle")
+
+    def append(self, chapter):
+        with open(self.chapter_path(self.num_chapters), "wb") as file:
+            pickle.dump(chapter, file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.num_chapters += 1
+
+    def __len__(self):
+        return self.num_chapters
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.num_chapters
+        if not 0 <= index < self.num_chapters:
+            raise IndexError("chapter index out of range")
+        with open(self.chapter_path(index), "rb") as file:
+            return pickle.load(file)
+
+    def __iter__(self):
+        for index in range(self.num_chapters):
+            yield self[index]
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
 class ParsedSelectableCategory:
     def __init__(self, name_string, columns_tuple):
         self.name = name_string
@@ -57,6 +104,159 @@ class ParsedChapter:
 class ParsedTemplate:
     def __init__(self):
         self.sides = []
+        # filled alongside sides when the parser emits tokens
+        self.tokens = []
+
+
+class CrossReferenceIndex:
+    # Reverse links from deck symbols to the objects that reference them,
+    # recorded by the parser as it resolves each reference.
+    def __init__(self):
+        self.categories = {}
+        self.selectables = {}
+        self.groups = {}
+        self.pair_groups = {}
+        self.recorded = set()
+
+    def add(self, table, name, kind, ref):
+        # table is "categories", "groups" or "pair_groups"
+        self.record((table,), getattr(self, table), name, kind, ref)
+
+    def add_selectable(self, category_name, variant_name, value, kind, ref):
+        variants = self.selectables.setdefault(category_name, {})
+        path = ("selectables", category_name, variant_name)
+        self.record(path, variants.setdefault(variant_name, {}), value, kind, ref)
+
+    def record(self, path, table, name, kind, ref):
+        # keyed on the table's path rather than the dict itself, so the keys
+        # still hold after the index has been pickled or copied. refs are
+        # names or small dicts built with a fixed key order.
+        if isinstance(ref, dict):
+            key = (path, name, kind, tuple(ref.values()))
+        else:
+            key = (path, name, kind, ref)
+        if key in self.recorded:
+            return
+        self.recorded.add(key)
+        table.setdefault(name, {}).setdefault(kind, []).append(ref)
+
+    def references(self, table, name, kind):
+        return list(table.get(name, {}).get(kind, []))
+
+    def group_impact(self, group_name):
+        return {
+            "templates": self.references(self.groups, group_name, "templates"),
+            "pairs": self.references(self.groups, group_name, "pairs"),
+        }
+
+    def pair_group_impact(self, pg_name):
+        return {
+            "templates": self.references(self.pair_groups, pg_name, "templates"),
+        }
+
+    def category_impact(self, category_name):
+        groups = self.references(self.categories, category_name, "groups")
+        pair_groups = self.references(self.categories, category_name, "pair_groups")
+        return self.merge_impact(
+            {
+                "groups": groups,
+                "pair_groups": pair_groups,
+                "vocab": self.references(self.categories, category_name, "vocab"),
+            },
+            groups,
+            pair_groups,
+        )
+
+    def selectable_impact(self, category_name, variant_name, value):
+        # what breaks if the selectable with this value in this variant changes
+        entry = self.selectables.get(category_name, {}).get(variant_name, {})
+        groups = self.references(entry, value, "groups")
+        pairs = self.references(entry, value, "pairs")
+        return self.merge_impact(
+            {
+                "groups": groups,
+                "pairs": pairs,
+                "vocab": self.references(entry, value, "vocab"),
+            },
+            groups,
+            [pair["pair_group"] for pair in pairs],
+        )
+
+    def merge_impact(self, impact, group_names, pg_names):
+        # follow groups and pair groups through to the templates and pairs using them
+        impact.setdefault("pairs", [])
+        impact["templates"] = []
+        for group_name in group_names:
+            for kind, refs in self.group_impact(group_name).items():
+                impact[kind].extend(ref for ref in refs if ref not in impact[kind])
+        pg_names = pg_names + [pair["pair_group"] for pair in impact["pairs"]]
+        for pg_name in dict.fromkeys(pg_names):
+            for ref in self.pair_group_impact(pg_name)["templates"]:
+                if ref not in impact["templates"]:
+                    impact["templates"].append(ref)
+        return impact
+
+    def to_dict(self):
+        return {
+            "categories": self.categories,
+            "selectables": self.selectables,
+            "groups": self.groups,
+            "pair_groups": self.pair_groups,
+        }
+
+
+class ValidationCache:
+    # Outcomes of template side validation, keyed on (side text, default
+    # variant). Each entry remembers the version of every category, group and
+    # pair group it looked at, and is only reused while none of them has been
+    # added to or extended since. A side is only cached once it has been seen
+    # twice, and at most `size` sides are kept, least recently used first out.
+    def __init__(self, size=4096):
+        self.size = size
+        self.entries = OrderedDict()
+        # sides seen once and not cached yet, bounded the same way
+        self.seen = OrderedDict()
+        # (table, name) -> version; name None stands for the table as a whole
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, table, name):
+        for key in ((table, name), (table, None)):
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def snapshot(self, dependencies):
+        return tuple((key, self.versions.get(key, 0)) for key in dependencies)
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry and all(
+            self.versions.get(key, 0) == version for key, version in entry["versions"]
+        ):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def should_store(self, key):
+        if key in self.entries:
+            # a stale entry, about to be replaced
+            return True
+        if key in self.seen:
+            del self.seen[key]
+            return True
+        self.seen[key] = None
+        if len(self.seen) > self.size:
+            self.seen.popitem(last=False)
+        return False
+
+    def store(self, key, entry, dependencies):
+        entry["versions"] = self.snapshot(dependencies)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
 
 
 class Parser:
@@ -73,10 +273,26 @@ class Parser:
         self.current_template = None
         self.parsed_deck = ParsedDeck()
         self.has_pair_groups = False
+        # a CrossReferenceIndex, if references should be recorded while parsing
+        self.xref = None
+        self.emit_references = False
+        self.validation_cache = ValidationCache()
+        # cross references made by the side being validated, for the cache
+        self.side_references = None
+        # "sides", "tokens" or "both", for how templates are emitted
+        self.template_output = "sides"
 
         self.issues = []
         self.infos = []
         self.debug = False
+        # deck sizes at the end of each parsed file, to attribute objects to files
+        self.file_marks = []
+
+        # optional live NDJSON record of every issue and info, e.g. sys.stderr
+        self.issue_stream = None
+        self.current_file = None
+        self.current_section = None
+        self.cancelled = False
 
     def process_line(self, line):
         self.line_index += 1
@@ -114,6 +330,7 @@ class Parser:
 
     def change_state(self, str):
         # TODO: ensure all transitions are in this order
+        self.current_section = str
         if str == "Selectables":
             # print("PARSING SELECTABLES")
             self.current_state = "ParseSelectables"
@@ -122,6 +339,7 @@ class Parser:
             # append leftover category, if it wasn't an extension
             if self.current_object:
                 self.parsed_deck.categories.append(self.current_object)
+                self.validation_cache.bump("categories", self.current_object.name)
             self.current_object = None
             self.current_subheader_str = None
 
@@ -136,12 +354,15 @@ class Parser:
             # append leftover pairgroup
             if self.has_pair_groups:
                 self.parsed_deck.pair_groups.append(self.current_object)
+                if self.current_object:
+                    self.validation_cache.bump("pair_groups", self.current_object.name)
             self.current_subheader_str = None
             self.current_object = None
 
             self.current_state = "ParseTemplates"
         else:
             self.current_state == None
+            self.current_section = None
             self.log_issue(f"Bad header '{str}'")
 
     def parse_selectables(self, line):
@@ -150,6 +371,7 @@ class Parser:
             ## finalize previous category, if it exists
             if self.current_object:
                 self.parsed_deck.categories.append(self.current_object)
+                self.validation_cache.bump("categories", self.current_object.name)
                 self.current_object = None
             elif self.extending_object_index != None:
                 self.extending_object_index = None
@@ -209,6 +431,7 @@ class Parser:
                     f"Extending category {category.name} with selectable {','.join(line)}"
                 )
                 category.selectables.append(parsed_selectable)
+                self.validation_cache.bump("categories", category.name)
             else:
                 # add selectable to new in-progress category
                 self.current_object.selectables.append(ParsedSelectable(line))
@@ -223,7 +446,9 @@ class Parser:
         key_variant = line[2]
         keys = line[3][1:-1].split(",")
 
-        self.check_group_integrity(category_name, key_variant, keys)
+        self.check_group_integrity(
+            category_name, key_variant, keys, ("groups", group_name)
+        )
 
         # Extend or fail for duplicate groups
         found_duplicate = False
@@ -251,15 +476,19 @@ class Parser:
                             self.log_info(f"Extended group {group_name} with key {key}")
                             self.parsed_deck.groups[i].keys.append(key)
                             extended = True
+                    if extended:
+                        self.validation_cache.bump("groups", group_name)
                     if not extended:
                         self.log_info(f"Duplicate group {group_name} had no new keys")
         if not found_duplicate:
             self.parsed_deck.groups.append(
                 ParsedGroup(group_name, category_name, key_variant, keys)
             )
+            self.validation_cache.bump("groups", group_name)
 
-    def check_group_integrity(self, category_name, key_variant, keys):
+    def check_group_integrity(self, category_name, key_variant, keys, reference):
         # Data integrity checking
+        # reference is the (kind, ref) recorded in the cross reference index
         found_category = None
         # check if the category exists
         for category in self.parsed_deck.categories:
@@ -269,6 +498,8 @@ class Parser:
         if not found_category:
             self.log_issue(f"No selectable category '{category_name}' found for group")
         else:
+            if self.xref:
+                self.xref.add("categories", category_name, *reference)
             # check if the key variant exists in the category
             found_key_variant_index = None
             for count, variant_name in enumerate(found_category.variant_names):
@@ -291,6 +522,10 @@ class Parser:
                         f"No selectable '{key}' under column '{key_variant}' "
                         f"found in selectable category '{category_name}'"
                     )
+                elif self.xref:
+                    self.xref.add_selectable(
+                        category_name, key_variant, key, *reference
+                    )
 
     def parse_pairgroups(self, line):
         # Obtain pairgroup name, prep new structure
@@ -298,6 +533,7 @@ class Parser:
             ## finalize previous pairgroup, if it exists
             if self.current_object:
                 self.parsed_deck.pair_groups.append(self.current_object)
+                self.validation_cache.bump("pair_groups", self.current_object.name)
                 self.current_object = None
             self.current_subheader_str = line[0][3:]
             self.following_subheader = True
@@ -339,6 +575,13 @@ class Parser:
                             f"Category '{category_name}' for column '{name}' not found"
                         )
                     else:
+                        if self.xref:
+                            self.xref.add(
+                                "categories",
+                                category_name,
+                                "pair_groups",
+                                self.current_subheader_str,
+                            )
                         ## check that the variant exists in the category
                         if variant_name not in found_category.variant_names:
                             validity = False
@@ -375,6 +618,8 @@ class Parser:
                 f"[{self.num_subheader_columns}]"
             )
         # Data integrity checking
+        # references are only recorded once the whole pair has been accepted
+        references = []
         for count, member in enumerate(line):
             if not self.current_object.valid:
                 self.log_issue(f"Pair not parsed as pair group is invalid")
@@ -386,6 +631,7 @@ class Parser:
                         f"No matching group for pair member '{member}' at index {count}"
                     )
                     return
+                references.append(("group", group.category_name, member))
                 # if not member in [group.name for group in self.parsed_deck.groups]:
                 if not self.current_object.category_checking[count]:
                     self.current_object.category_checking[count] = group.category_name
@@ -434,6 +680,23 @@ class Parser:
                         f"'{found_category.name}', column {found_key_variant_index}"
                     )
                     return
+                references.append(("selectable", category_name, variant_name, member))
+        if self.xref:
+            pair_reference = {
+                "pair_group": self.current_object.name,
+                "index": len(self.current_object.pairs),
+            }
+            for reference in references:
+                if reference[0] == "group":
+                    self.xref.add(
+                        "categories",
+                        reference[1],
+                        "pair_groups",
+                        self.current_object.name,
+                    )
+                    self.xref.add("groups", reference[2], "pairs", pair_reference)
+                else:
+                    self.xref.add_selectable(*reference[1:], "pairs", pair_reference)
         self.current_object.pairs.append(line)
 
     def parse_templates(self, line):
@@ -505,11 +768,16 @@ class Parser:
 
             # data integrity
             default = self.current_object.column_variants[true_label_index]
-            if self.check_template_side_integrity(line_str, default):
+            tokens, integrity_good = self.validate_side(line_str, default)
+            if integrity_good:
                 if is_forced_first:
                     self.current_template.sides.insert(0, line_str)
+                    if self.template_output != "sides":
+                        self.current_template.tokens.insert(0, tokens)
                 else:
                     self.current_template.sides.append(line_str)
+                    if self.template_output != "sides":
+                        self.current_template.tokens.append(tokens)
 
             self.num_template_sides += 1
 
@@ -519,58 +787,126 @@ class Parser:
         key_variant = line[1]
         keys = line[2][1:-1].split(",")
 
-        self.check_group_integrity(category_name, key_variant, keys)
+        reference = {
+            "chapter": self.current_object.name,
+            "index": len(self.current_object.vocab),
+        }
+        self.check_group_integrity(
+            category_name, key_variant, keys, ("vocab", reference)
+        )
 
         self.current_object.vocab.append(
             ParsedGroup("vocab", category_name, key_variant, keys)
         )
         return
 
-    def check_template_side_integrity(self, text, default):
-        if default[0] == "~":
-            default = default[1:]
-        replaceables = re.findall(r"\[(.*?)\]", text)
+    def validate_side(self, text, default):
+        # returns the side's tokens and whether it passed, replaying the issues
+        # and cross references of an earlier identical side when possible.
+        # Tokens are None for a cached side when the output does not use them.
+        cache = self.validation_cache
+        if not cache.size:
+            tokens = tokenize_side(text, default)
+            return tokens, self.check_side_tokens(tokens)
+        key = (text, default)
+        entry = cache.lookup(key)
+        if entry:
+            for str in entry["issues"]:
+                self.log_issue(str)
+            for table, name in entry["references"]:
+                self.reference_template(table, name)
+            return entry["tokens"], entry["result"]
+
+        tokens = tokenize_side(text, default)
+        if not cache.should_store(key):
+            return tokens, self.check_side_tokens(tokens)
+        first_issue = len(self.issues)
+        if self.xref:
+            self.side_references = []
+        try:
+            result = self.check_side_tokens(tokens)
+            entry = {
+                "tokens": tokens if self.template_output != "sides" else None,
+                "result": result,
+                "issues": [str for _, str in self.issues[first_issue:]],
+                "references": self.side_references or [],
+            }
+        finally:
+            self.side_references = None
+        cache.store(key, entry, self.side_dependencies(tokens))
+        return tokens, result
+
+    def side_dependencies(self, tokens):
+        # every symbol check_side_tokens may look up for these tokens
+        dependencies = []
+        for token in tokens:
+            if token["type"] == "group":
+                dependencies.append(("groups", token["group"]))
+                group = self.get_object_by_name(token["group"], self.parsed_deck.groups)
+                if group:
+                    dependencies.append(("categories", group.category_name))
+            elif token["type"] == "pair":
+                dependencies.append(("pair_groups", None))
+                dependencies.append(("pair_groups", token["pair_group"]))
+                pair_group = self.get_object_by_name(
+                    token["pair_group"], filter(None, self.parsed_deck.pair_groups)
+                )
+                if not pair_group:
+                    continue
+                for count, type in enumerate(pair_group.column_types):
+                    type = type.split(":")
+                    if type[0] == "selectable" and len(type) > 1:
+                        dependencies.append(("categories", type[1]))
+                    elif type[0] == "group" and pair_group.pairs:
+                        if count >= len(pair_group.pairs[0]):
+                            continue
+                        group_name = pair_group.pairs[0][count]
+                        dependencies.append(("groups", group_name))
+                        group = self.get_object_by_name(
+                            group_name, self.parsed_deck.groups
+                        )
+                        if group:
+                            dependencies.append(("categories", group.category_name))
+        return dependencies
+
+    def check_side_tokens(self, tokens):
         integrity_good = True
-        group_variants = []
-        for rep in replaceables:
-            rep = rep.split(":")
-            group = rep[0]
-            if len(rep) == 1:
-                variant = default
-            else:
-                variant = rep[1]
-            group_variants.append((group, variant))
-        for gv in group_variants:
-            found_group = self.get_object_by_name(gv[0], self.parsed_deck.groups)
+        for token in tokens:
+            if token["type"] != "group":
+                continue
+            found_group = self.get_object_by_name(
+                token["group"], self.parsed_deck.groups
+            )
             if not found_group:
-                self.log_issue(f"No group '{gv[0]}' found for side")
+                self.log_issue(f"No group '{token['group']}' found for side")
                 integrity_good = False
             else:
+                self.reference_template("groups", token["group"])
                 category = self.get_object_by_name(
                     found_group.category_name, self.parsed_deck.categories
                 )
-                if not gv[1] in category.variant_names:
+                if not token["variant"] in category.variant_names:
                     self.log_issue(
-                        f"No variant '{gv[1]}' in category '{category.name}', used "
-                        f"in group '{gv[0]}'"
+                        f"No variant '{token['variant']}' in category '{category.name}', "
+                        f"used in group '{token['group']}'"
                     )
                     integrity_good = False
 
-        pg_replaceables = re.findall(r"\<(.*?)\>", text)
+        pg_tokens = [token for token in tokens if token["type"] == "pair"]
         first_pg_name = None
-        if pg_replaceables and not self.parsed_deck.pair_groups:
+        if pg_tokens and not self.parsed_deck.pair_groups:
             self.log_issue(f"Contains pair group, but no pair groups in deck")
             integrity_good = False
             return
-        for pg in pg_replaceables:
-            pg = pg.split(":")
+        for token in pg_tokens:
+            pg_name = token["pair_group"]
             # pair groups need at least a name and alias
-            if len(pg) < 2:
+            if token["alias"] is None:
                 self.log_issue(
-                    f"Not enough type information in Pair Group replaceable '{pg}'"
+                    f"Not enough type information in Pair Group replaceable '{pg_name}'"
                 )
                 integrity_good = False
-            pg_name = pg[0]
+                continue
             # only allow one pair group per side
             # TODO: it should be only one per template, too, but that'd be harder to mess up
             if not first_pg_name:
@@ -582,10 +918,8 @@ class Parser:
                     )
                     integrity_good = False
             # gather other pg information
-            pg_alias = pg[1]
-            pg_varlabel = None
-            if len(pg) == 3:
-                pg_varlabel = pg[2]
+            pg_alias = token["alias"]
+            pg_variant = token["variant"]
 
             pair_group = next(
                 (
@@ -599,6 +933,7 @@ class Parser:
             if not pair_group:
                 self.log_issue(f"Could not find pair group '{pg_name}'")
             else:
+                self.reference_template("pair_groups", pg_name)
                 aliases = pair_group.column_names
                 types = pair_group.column_types
                 ## check if the alias exists
@@ -617,17 +952,17 @@ class Parser:
                             category_name, self.parsed_deck.categories
                         )
                         # don't check if category exists, we already did
-                        if pg_varlabel:
-                            if not pg_varlabel in category.variant_names:
+                        if token["explicit"]:
+                            if not pg_variant in category.variant_names:
                                 self.log_issue(
                                     f"No variant in '{category_name}' named "
-                                    f"'{pg_varlabel}'"
+                                    f"'{pg_variant}'"
                                 )
                         else:
-                            if not default in category.variant_names:
+                            if not pg_variant in category.variant_names:
                                 self.log_issue(
                                     f"Autoassigned variant for '{category_name}' "
-                                    f"does not match '{default}'"
+                                    f"does not match '{pg_variant}'"
                                 )
                     elif cata == "group":
                         # selectable must be the same across groups, so it'll be the same
@@ -639,21 +974,33 @@ class Parser:
                         category = self.get_object_by_name(
                             found_group.category_name, self.parsed_deck.categories
                         )
-                        if pg_varlabel:
-                            if not pg_varlabel in category.variant_names:
+                        if token["explicit"]:
+                            if not pg_variant in category.variant_names:
                                 self.log_issue(
                                     f"No variant for group's category '{category.name}' named "
-                                    f"'{pg_varlabel}'"
+                                    f"'{pg_variant}'"
                                 )
                         else:
-                            if not default in category.variant_names:
+                            if not pg_variant in category.variant_names:
                                 self.log_issue(
                                     f"Autoassigned variant for group '{category.name}' "
-                                    f"does not match '{default}'"
+                                    f"does not match '{pg_variant}'"
                                 )
 
         return integrity_good
 
+    def reference_template(self, table, name):
+        # table is "groups" or "pair_groups"
+        if self.side_references is not None:
+            self.side_references.append((table, name))
+        # the template being validated is the next one to be added to its chapter
+        if self.xref and isinstance(self.current_object, ParsedChapter):
+            reference = {
+                "chapter": self.current_object.name,
+                "index": len(self.current_object.templates),
+            }
+            self.xref.add(table, name, "templates", reference)
+
     def get_object_by_name(self, object_name, object_list):
         object = next(
             (object for object in object_list if object.name == object_name),
@@ -664,8 +1011,10 @@ class Parser:
     def handle_eof(self):
         # process any final, unhandled chapter of templates
         self.parsed_deck.chapters.append(self.current_object)
+        self.mark_file_end()
         # reset all working values
         self.current_state = None
+        self.current_section = None
         self.line_index = 0
         self.current_subheader_str = None
         self.extending_object_index = None
@@ -675,15 +1024,90 @@ class Parser:
         self.num_template_sides = 0
         self.current_template = None
 
-    def print_json(self):
-        json_data = json.dumps(self.parsed_deck, default=lambda o: o.__dict__, indent=4)
-        print(json_data)
+    def mark_file_end(self):
+        deck = self.parsed_deck
+        self.file_marks.append(
+            {
+                "categories": [len(c.selectables) for c in deck.categories],
+                "groups": [len(g.keys) for g in deck.groups],
+                "pair_groups": [len(pg.pairs) if pg else 0 for pg in deck.pair_groups],
+                "chapters": len(deck.chapters),
+            }
+        )
+
+    def spill_chapters(self, directory=None):
+        # only the symbols needed for validation stay resident from here on
+        store = ChapterStore(directory)
+        for chapter in self.parsed_deck.chapters:
+            store.append(chapter)
+        self.parsed_deck.chapters = store
+        return store
+
+    def print_json(self, file=None):
+        # written field by field, so spilled chapters are streamed from disk
+        # rather than assembled in memory. Output matches json.dumps(indent=4).
+        if file is None:
+            file = sys.stdout
+        fields = list(self.parsed_deck.__dict__.items())
+        if self.emit_references and self.xref:
+            fields.append(("references", self.xref.to_dict()))
+        file.write("{")
+        for count, (key, value) in enumerate(fields):
+            if count:
+                file.write(",")
+            file.write(f"\n    {json.dumps(key)}: ")
+            if isinstance(value, dict):
+                file.write(self.json_dumps(value, depth=1))
+                continue
+            if not len(value):
+                file.write("[]")
+                continue
+            file.write("[")
+            for item_count, item in enumerate(value):
+                if item_count:
+                    file.write(",")
+                file.write("\n        " + self.json_dumps(item, depth=2))
+            file.write("\n    ]")
+        file.write("\n}\n")
+
+    def json_dumps(self, obj, depth=0):
+        json_data = json.dumps(obj, default=self.json_default, indent=4)
+        return json_data.replace("\n", "\n" + "    " * depth)
+
+    def json_default(self, obj):
+        if isinstance(obj, ParsedTemplate):
+            if self.template_output == "sides":
+                return {"sides": obj.sides}
+            if self.template_output == "tokens":
+                return {"tokens": obj.tokens}
+        return obj.__dict__
 
     def log_issue(self, str):
         self.issues.append((self.line_index, str))
+        self.stream_record("issue", str)
 
     def log_info(self, str):
         self.infos.append((self.line_index, str))
+        self.stream_record("info", str)
+
+    def stream_record(self, severity, str):
+        if not self.issue_stream:
+            return
+        record = {
+            "file": self.current_file,
+            "line": self.line_index,
+            "severity": severity,
+            "section": self.current_section,
+            "subsection": self.current_subheader_str,
+            "message": str,
+        }
+        try:
+            self.issue_stream.write(json.dumps(record) + "\n")
+            self.issue_stream.flush()
+        except (BrokenPipeError, ValueError):
+            # the consumer closed the stream, which is our signal to stop parsing
+            self.issue_stream = None
+            self.cancelled = True
 
     def print_issues(self):
         if len(self.issues) > 0:
@@ -692,13 +1116,70 @@ class Parser:
             print(issue)
 
 
-def parse_file_lines(lacparser: Parser, file_str, verbose, primary=False):
+def iter_file_lines(file_str):
+    # rows are split as they are parsed, so only one is held at a time
     with open(file_str, "r") as file:
-        reader = csv.reader(file, delimiter=";")
-        data = list(reader)
+        yield from csv.reader(file, delimiter=";")
+
+
+def read_file_lines(file_str):
+    return list(iter_file_lines(file_str))
+
+
+class ChainLoader:
+    # Reads and splits the files of a -f chain ahead of the parser, in worker
+    # threads (or processes), yielding them in chain order. At most `depth`
+    # files are loaded ahead of the one being parsed. csv splitting holds the
+    # GIL, so threads mostly overlap disk reads with parsing.
+    def __init__(self, file_strs, depth=0, processes=False):
+        self.file_strs = list(file_strs)
+        self.depth = depth
+        self.executor = None
+        if depth > 0:
+            executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            self.executor = executor_class(max_workers=depth)
+
+    def __iter__(self):
+        if not self.executor:
+            for file_str in self.file_strs:
+                yield file_str, iter_file_lines(file_str)
+            return
+        pending = deque()
+        upcoming = iter(self.file_strs)
+        for file_str in upcoming:
+            pending.append((file_str, self.executor.submit(read_file_lines, file_str)))
+            if len(pending) >= self.depth:
+                break
+        while pending:
+            file_str, future = pending.popleft()
+            # refill before handing the current file over, to keep workers busy
+            next_file = next(upcoming, None)
+            if next_file is not None:
+                pending.append(
+                    (next_file, self.executor.submit(read_file_lines, next_file))
+                )
+            yield file_str, future.result()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_file_lines(lacparser: Parser, file_str, verbose, primary=False, data=None):
+    if data is None:
+        data = iter_file_lines(file_str)
 
     lacparser.line_index = 0
+    lacparser.current_file = file_str
     for line in data:
+        if lacparser.cancelled:
+            return
         if verbose and primary:
             print(",".join(line))
         lacparser.process_line(line)
@@ -737,30 +1218,171 @@ if __name__ == "__main__":
         action="store_true",
         help="Show additional information about deck redundancy",
     )
+    argparser.add_argument(
+        "-p",
+        "--prefetch",
+        metavar="FILES",
+        type=int,
+        default=0,
+        help="Number of chain files to read and split ahead of the parser in "
+        "background threads (default: 0, read each file in turn)",
+    )
+    argparser.add_argument(
+        "--prefetch-processes",
+        action="store_true",
+        help="Read ahead in worker processes instead of threads",
+    )
+    argparser.add_argument(
+        "--validation-cache",
+        metavar="SIDES",
+        type=int,
+        default=4096,
+        help="Number of repeated template sides to keep validation results for, "
+        "0 to disable (default: 4096)",
+    )
+    argparser.add_argument(
+        "-s",
+        "--stream-issues",
+        action="store_true",
+        help="Stream issues and infos to stderr as NDJSON records as they are found",
+    )
+    argparser.add_argument(
+        "-m",
+        "--low-memory",
+        action="store_true",
+        help="Keep finished chapters in a temporary store on disk instead of memory",
+    )
+    argparser.add_argument(
+        "--spill-dir",
+        metavar="DIR",
+        help="Directory for the low memory chapter store (default: system temp)",
+    )
+    argparser.add_argument(
+        "-t",
+        "--template-output",
+        choices=["sides", "tokens", "both"],
+        default="sides",
+        help="Emit templates as raw side strings, pre-tokenized sides, or both",
+    )
+    argparser.add_argument(
+        "-n",
+        "--normalize-ids",
+        action="store_true",
+        help="Print the deck with integer IDs in place of repeated names, "
+        "see lacu_ids.py",
+    )
+    argparser.add_argument(
+        "-x",
+        "--emit-references",
+        action="store_true",
+        help="Add a reverse index of what references each category, selectable, "
+        "group and pair group to the JSON output",
+    )
+    argparser.add_argument(
+        "--sqlite",
+        metavar="DB_FILE",
+        help="Also write the deck to an indexed SQLite database, updating it in "
+        "place from the first changed file of the chain",
+    )
+    argparser.add_argument(
+        "--binary",
+        metavar="BINARY_FILE",
+        help="Also write the deck in the memory-mappable binary format, "
+        "see lacu_binary.py",
+    )
+    argparser.add_argument(
+        "--shard-dir",
+        metavar="DIR",
+        help="Also write the shared symbols and each chapter as separate shard "
+        "files, listed with their sizes, hashes and dependencies in a manifest",
+    )
+    argparser.add_argument(
+        "-z",
+        "--gzip",
+        action="store_true",
+        help="Compress shard files with gzip",
+    )
+    argparser.add_argument(
+        "--duplicate-report",
+        metavar="REPORT_FILE",
+        help="Write a JSON report of duplicated and near-duplicated deck contents",
+    )
+
+    argparser.add_argument(
+        "--card-report",
+        metavar="REPORT_FILE",
+        help="Write a JSON report of the number of cards per template and chapter",
+    )
+    argparser.add_argument(
+        "--card-budget",
+        metavar="CARDS",
+        type=int,
+        help="Flag templates expanding to more cards than this in the card report",
+    )
 
     args = argparser.parse_args()
     lacparser = Parser()
     if args.debug:
         lacparser.debug = True
-    if args.prior_files:
-        for count, file_str in enumerate(args.prior_files):
+    if args.stream_issues:
+        lacparser.issue_stream = sys.stderr
+    lacparser.template_output = args.template_output
+    lacparser.validation_cache = ValidationCache(args.validation_cache)
+    lacparser.emit_references = args.emit_references
+    if args.emit_references:
+        lacparser.xref = CrossReferenceIndex()
+    if args.low_memory:
+        atexit.register(lacparser.spill_chapters(args.spill_dir).close)
+    prior_files = args.prior_files or []
+    chain = prior_files + [args.primary_file]
+    # files read ahead are held in memory whole, which -m is meant to avoid
+    prefetch = 0 if args.low_memory else args.prefetch
+    with ChainLoader(chain, prefetch, args.prefetch_processes) as loader:
+        for count, (file_str, data) in enumerate(loader):
+            primary = count == len(prior_files)
             if args.list_infos:
-                print(f"PARSING PRIOR FILE: {file_str}")
-            parse_file_lines(lacparser, file_str, args.verbose, primary=False)
-            if lacparser.issues:
+                if primary:
+                    print(f"PARSING MAIN FILE: {file_str}")
+                else:
+                    print(f"PARSING PRIOR FILE: {file_str}")
+            parse_file_lines(lacparser, file_str, args.verbose, primary, data)
+            if lacparser.cancelled:
+                exit()
+            if lacparser.issues and not primary:
                 print(
                     f"Error: precedent file {count} contains issues before primary file"
                 )
                 exit()
 
-    if args.list_infos:
-        print(f"PARSING MAIN FILE: {args.primary_file}")
-    parse_file_lines(lacparser, args.primary_file, args.verbose, primary=True)
-
+    if args.debug:
+        cache = lacparser.validation_cache
+        print(
+            f"Validation cache: {cache.hits} hits, {cache.misses} misses",
+            file=sys.stderr,
+        )
     lacparser.print_issues()
     if not args.issues_only:
-        lacparser.print_json()
+        if args.normalize_ids:
+            print_ids(lacparser.parsed_deck)
+        else:
+            lacparser.print_json()
     if args.list_infos:
         print("INFO:")
         for info in lacparser.infos:
             print(info)
+    if args.sqlite:
+        source_files = (args.prior_files or []) + [args.primary_file]
+        write_sqlite(
+            lacparser.parsed_deck, args.sqlite, source_files, lacparser.file_marks
+        )
+    if args.binary:
+        write_binary(lacparser.parsed_deck, args.binary)
+    if args.shard_dir:
+        write_shards(
+            lacparser.parsed_deck, args.shard_dir, args.gzip, lacparser.json_default
+        )
+    if args.duplicate_report:
+        write_report(find_duplicates(lacparser.parsed_deck), args.duplicate_report)
+    if args.card_report:
+        report = count_cards(lacparser.parsed_deck, args.card_budget)
+        write_report(report, args.card_report)
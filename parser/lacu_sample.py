@@ -0,0 +1,202 @@
+import sys
+import json
+import random
+import argparse
+from bisect import bisect_right
+
+from lacu_parse import Parser, parse_file_lines
+from lacu_analyze import CardCounter, template_references
+from lacu_tokens import tokenize_side
+
+
+class CardSampler:
+    # Draws cards uniformly from the templates of a deck without expanding them.
+    # Each template is weighted by its card count, and a card within a template
+    # is decoded from its index by picking group keys and pairs in turn, so time
+    # and memory do not depend on the total number of cards.
+    def __init__(self, deck, chapter_names=None, seed=None):
+        self.deck = deck
+        self.counter = CardCounter(deck)
+        self.random = random.Random(seed)
+        self.categories = {}
+        for category in deck.categories:
+            self.categories.setdefault(category.name, category)
+        self.selectable_indexes = {}
+
+        # precomputed per-template weights, as a running total
+        self.templates = []
+        self.cumulative = [0]
+        for chapter in deck.chapters:
+            if not chapter:
+                continue
+            if chapter_names and chapter.name not in chapter_names:
+                continue
+            for count, template in enumerate(chapter.templates):
+                cards = self.counter.count_template(template)
+                if cards:
+                    self.templates.append((chapter, count, template))
+                    self.cumulative.append(self.cumulative[-1] + cards)
+        self.num_cards = self.cumulative[-1]
+
+    def sample(self, k=1, replacement=True):
+        if not self.num_cards:
+            raise ValueError("no cards to sample from")
+        if replacement:
+            indexes = [self.random.randrange(self.num_cards) for _ in range(k)]
+        elif k > self.num_cards:
+            raise ValueError(f"cannot draw {k} unique cards from {self.num_cards}")
+        elif 2 * k > self.num_cards:
+            # the deck is small next to k, so rejection would retry too often
+            indexes = self.random.sample(range(self.num_cards), k)
+        else:
+            # redraw repeats, which only tracks the k indexes drawn and works
+            # for card counts too large for random.sample's range()
+            indexes = []
+            seen = set()
+            while len(indexes) < k:
+                index = self.random.randrange(self.num_cards)
+                if index not in seen:
+                    seen.add(index)
+                    indexes.append(index)
+        return [self.card(index) for index in indexes]
+
+    def card(self, index):
+        position = bisect_right(self.cumulative, index) - 1
+        chapter, template_index, template = self.templates[position]
+        remainder = index - self.cumulative[position]
+        group_names, pair_columns = template_references(template)
+
+        # decode the index within the template as mixed-radix digits
+        group_keys = {}
+        for group_name in group_names:
+            group = self.counter.groups[group_name]
+            remainder, digit = divmod(remainder, len(group.keys))
+            group_keys[group_name] = group.keys[digit]
+        pairs = {}
+        for pg_name, aliases in pair_columns.items():
+            columns, cumulative = self.counter.cumulative_pair_weights(pg_name, aliases)
+            remainder, offset = divmod(remainder, cumulative[-1])
+            pair_index = bisect_right(cumulative, offset) - 1
+            offset -= cumulative[pair_index]
+            pair = self.counter.pair_groups[pg_name].pairs[pair_index]
+            member_keys = {}
+            for column in columns:
+                group = self.counter.groups[pair[column]]
+                offset, digit = divmod(offset, len(group.keys))
+                member_keys[column] = group.keys[digit]
+            pairs[pg_name] = (pair, member_keys)
+
+        sides = []
+        for count, side in enumerate(template.sides):
+            tokens = tokenize_side(side, chapter.column_variants[count])
+            sides.append(self.render(tokens, group_keys, pairs))
+        return {"chapter": chapter.name, "template": template_index, "sides": sides}
+
+    def render(self, tokens, group_keys, pairs):
+        parts = []
+        for token in tokens:
+            if token["type"] == "literal":
+                parts.append(token["text"])
+            elif token["type"] == "group":
+                group = self.counter.groups[token["group"]]
+                parts.append(
+                    self.variant_value(
+                        group.category_name,
+                        group.key_variant_name,
+                        group_keys[token["group"]],
+                        token["variant"],
+                    )
+                )
+            else:
+                pair_group = self.counter.pair_groups[token["pair_group"]]
+                pair, member_keys = pairs[token["pair_group"]]
+                column = pair_group.column_names.index(token["alias"])
+                type = pair_group.column_types[column].split(":")
+                if type[0] == "group":
+                    group = self.counter.groups[pair[column]]
+                    parts.append(
+                        self.variant_value(
+                            group.category_name,
+                            group.key_variant_name,
+                            member_keys[column],
+                            token["variant"],
+                        )
+                    )
+                else:
+                    parts.append(
+                        self.variant_value(
+                            type[1], type[2], pair[column], token["variant"]
+                        )
+                    )
+        return "".join(parts)
+
+    def variant_value(self, category_name, key_variant, key, variant):
+        # looks up the selectable whose key variant is `key`, and returns its
+        # value for `variant`. Falls back to the key if either is missing.
+        category = self.categories.get(category_name)
+        if not category:
+            return key
+        index_key = (category_name, key_variant)
+        if index_key not in self.selectable_indexes:
+            index = {}
+            if key_variant in category.variant_names:
+                key_index = category.variant_names.index(key_variant)
+                for selectable in category.selectables:
+                    index.setdefault(selectable.variants[key_index], selectable)
+            self.selectable_indexes[index_key] = index
+        selectable = self.selectable_indexes[index_key].get(key)
+        if not selectable or variant not in category.variant_names:
+            return key
+        return selectable.variants[category.variant_names.index(variant)]
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Lacuna Card Sampler")
+    argparser.add_argument(
+        "primary_file",
+        metavar="FILE",
+        help="Deck file to sample cards from",
+    )
+    argparser.add_argument(
+        "-f",
+        "--prior-files",
+        metavar="PRIOR_FILE",
+        nargs="+",
+        help="Preceding decks to supply data to the current file",
+    )
+    argparser.add_argument(
+        "-c",
+        "--chapters",
+        metavar="CHAPTER",
+        nargs="+",
+        help="Only sample from these chapters",
+    )
+    argparser.add_argument(
+        "-k", "--count", type=int, default=1, help="Number of cards to draw"
+    )
+    argparser.add_argument(
+        "-u",
+        "--unique",
+        action="store_true",
+        help="Draw without replacement",
+    )
+    argparser.add_argument("-s", "--seed", type=int, help="Seed for reproducible draws")
+
+    args = argparser.parse_args()
+    lacparser = Parser()
+    for file_str in (args.prior_files or []) + [args.primary_file]:
+        parse_file_lines(lacparser, file_str, False)
+    if lacparser.issues:
+        lacparser.print_issues()
+        sys.exit(1)
+
+    sampler = CardSampler(lacparser.parsed_deck, args.chapters, args.seed)
+    try:
+        cards = sampler.sample(args.count, replacement=not args.unique)
+    except ValueError as e:
+        if args.chapters:
+            print(f"Error: {e} in chapters {' '.join(args.chapters)}")
+        else:
+            print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(cards, indent=4))
@@ -0,0 +1,106 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+
+from lacu_analyze import template_references
+from lacu_files import MANIFEST_NAME, file_sha256
+
+SHARD_PATTERN = re.compile(r"^(symbols|chapter-\d+)\.json(\.gz)?$")
+
+
+def chapter_dependencies(chapter, groups, pair_groups):
+    group_names = {}
+    pg_names = {}
+    category_names = {}
+    for template in chapter.templates:
+        template_groups, template_pair_groups = template_references(template)
+        for group_name in template_groups:
+            group_names[group_name] = None
+        for pg_name in template_pair_groups:
+            pg_names[pg_name] = None
+
+    # pair groups draw on the groups and categories named in their columns
+    for pg_name in pg_names:
+        pair_group = pair_groups.get(pg_name)
+        if not pair_group:
+            continue
+        for count, type in enumerate(pair_group.column_types):
+            type = type.split(":")
+            if type[0] == "group":
+                for pair in pair_group.pairs:
+                    group_names[pair[count]] = None
+            elif type[0] == "selectable" and len(type) > 1:
+                category_names[type[1]] = None
+
+    for group_name in group_names:
+        if group_name in groups:
+            category_names[groups[group_name].category_name] = None
+    for vocab in chapter.vocab:
+        category_names[vocab.category_name] = None
+
+    return {
+        "categories": list(category_names),
+        "groups": list(group_names),
+        "pair_groups": list(pg_names),
+    }
+
+
+def write_shard(directory, name, obj, default, compress):
+    data = json.dumps(obj, default=default, separators=(",", ":")).encode("utf-8")
+    file_name = name + ".json"
+    if compress:
+        # a fixed mtime keeps the compressed bytes, and so the hash, reproducible
+        data = gzip.compress(data, mtime=0)
+        file_name += ".gz"
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    # leave unchanged shards untouched, so file based syncing can skip them too
+    path = os.path.join(directory, file_name)
+    if not os.path.exists(path) or file_sha256(path) != sha256:
+        with open(path, "wb") as file:
+            file.write(data)
+    return {"file": file_name, "bytes": len(data), "sha256": sha256}
+
+
+def write_shards(deck, directory, compress=False, default=lambda o: o.__dict__):
+    os.makedirs(directory, exist_ok=True)
+    groups = {}
+    for group in deck.groups:
+        groups.setdefault(group.name, group)
+    pair_groups = {}
+    for pair_group in deck.pair_groups:
+        if pair_group:
+            pair_groups.setdefault(pair_group.name, pair_group)
+
+    symbols = {
+        "categories": deck.categories,
+        "groups": deck.groups,
+        "pair_groups": deck.pair_groups,
+    }
+    manifest = {
+        "compression": "gzip" if compress else None,
+        "symbols": write_shard(directory, "symbols", symbols, default, compress),
+        "chapters": [],
+    }
+    for count, chapter in enumerate(deck.chapters):
+        if not chapter:
+            continue
+        entry = {"name": chapter.name}
+        entry.update(
+            write_shard(directory, f"chapter-{count:04d}", chapter, default, compress)
+        )
+        entry.update(chapter_dependencies(chapter, groups, pair_groups))
+        manifest["chapters"].append(entry)
+
+    # remove shards left over from an earlier, larger or differently compressed deck
+    current = {manifest["symbols"]["file"]}
+    current.update(entry["file"] for entry in manifest["chapters"])
+    for file_name in os.listdir(directory):
+        if SHARD_PATTERN.match(file_name) and file_name not in current:
+            os.remove(os.path.join(directory, file_name))
+
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=4)
+    return manifest
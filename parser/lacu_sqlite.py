@@ -0,0 +1,291 @@
+import sqlite3
+
+from lacu_tokens import tokenize_side
+from lacu_files import file_sha256
+
+SCHEMA_VERSION = 1
+
+# every row carries the position of the file in the -f chain that introduced
+# it, so a rebuild only has to replace rows from the first changed file onwards
+SCHEMA = """
+CREATE TABLE sources (position INTEGER PRIMARY KEY, path TEXT, sha256 TEXT);
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY, name TEXT, source INTEGER
+);
+CREATE TABLE variants (
+    category_id INTEGER, position INTEGER, name TEXT, source INTEGER,
+    PRIMARY KEY (category_id, position)
+);
+CREATE TABLE selectables (
+    category_id INTEGER, position INTEGER, source INTEGER,
+    PRIMARY KEY (category_id, position)
+);
+CREATE TABLE selectable_values (
+    category_id INTEGER, selectable_position INTEGER, variant_position INTEGER,
+    value TEXT, source INTEGER,
+    PRIMARY KEY (category_id, selectable_position, variant_position)
+);
+CREATE TABLE groups (
+    id INTEGER PRIMARY KEY, name TEXT, category_name TEXT, key_variant TEXT,
+    source INTEGER
+);
+CREATE TABLE group_keys (
+    group_id INTEGER, position INTEGER, value TEXT, source INTEGER,
+    PRIMARY KEY (group_id, position)
+);
+CREATE TABLE pair_groups (
+    id INTEGER PRIMARY KEY, name TEXT, valid INTEGER, source INTEGER
+);
+CREATE TABLE pair_columns (
+    pair_group_id INTEGER, position INTEGER, name TEXT, type TEXT, source INTEGER,
+    PRIMARY KEY (pair_group_id, position)
+);
+CREATE TABLE pairs (
+    pair_group_id INTEGER, position INTEGER, source INTEGER,
+    PRIMARY KEY (pair_group_id, position)
+);
+CREATE TABLE pair_members (
+    pair_group_id INTEGER, pair_position INTEGER, column_position INTEGER,
+    value TEXT, source INTEGER,
+    PRIMARY KEY (pair_group_id, pair_position, column_position)
+);
+CREATE TABLE chapters (
+    id INTEGER PRIMARY KEY, name TEXT, forced_first_side INTEGER, source INTEGER
+);
+CREATE TABLE chapter_columns (
+    chapter_id INTEGER, position INTEGER, variant TEXT, source INTEGER,
+    PRIMARY KEY (chapter_id, position)
+);
+CREATE TABLE templates (
+    chapter_id INTEGER, position INTEGER, source INTEGER,
+    PRIMARY KEY (chapter_id, position)
+);
+CREATE TABLE template_sides (
+    chapter_id INTEGER, template_position INTEGER, position INTEGER, text TEXT,
+    source INTEGER,
+    PRIMARY KEY (chapter_id, template_position, position)
+);
+CREATE TABLE template_groups (
+    chapter_id INTEGER, template_position INTEGER, side_position INTEGER,
+    group_name TEXT, variant TEXT, source INTEGER
+);
+CREATE TABLE template_pair_groups (
+    chapter_id INTEGER, template_position INTEGER, side_position INTEGER,
+    pair_group_name TEXT, alias TEXT, variant TEXT, source INTEGER
+);
+CREATE TABLE vocab (
+    chapter_id INTEGER, position INTEGER, category_name TEXT, key_variant TEXT,
+    source INTEGER,
+    PRIMARY KEY (chapter_id, position)
+);
+CREATE TABLE vocab_keys (
+    chapter_id INTEGER, vocab_position INTEGER, position INTEGER, value TEXT,
+    source INTEGER,
+    PRIMARY KEY (chapter_id, vocab_position, position)
+);
+CREATE INDEX categories_name ON categories (name);
+CREATE INDEX variants_name ON variants (name, category_id);
+CREATE INDEX selectable_values_value
+    ON selectable_values (category_id, variant_position, value);
+CREATE INDEX groups_name ON groups (name);
+CREATE INDEX groups_category ON groups (category_name, key_variant);
+CREATE INDEX group_keys_value ON group_keys (value);
+CREATE INDEX pair_groups_name ON pair_groups (name);
+CREATE INDEX pair_members_value ON pair_members (value, column_position);
+CREATE INDEX chapters_name ON chapters (name);
+CREATE INDEX template_groups_name ON template_groups (group_name, variant);
+CREATE INDEX template_pair_groups_name
+    ON template_pair_groups (pair_group_name, alias);
+CREATE INDEX vocab_category ON vocab (category_name, key_variant);
+CREATE INDEX vocab_keys_value ON vocab_keys (value);
+"""
+
+# insertion order, parents first
+TABLES = [
+    ("categories", 3),
+    ("variants", 4),
+    ("selectables", 3),
+    ("selectable_values", 5),
+    ("groups", 5),
+    ("group_keys", 4),
+    ("pair_groups", 4),
+    ("pair_columns", 5),
+    ("pairs", 3),
+    ("pair_members", 5),
+    ("chapters", 4),
+    ("chapter_columns", 4),
+    ("templates", 3),
+    ("template_sides", 5),
+    ("template_groups", 6),
+    ("template_pair_groups", 7),
+    ("vocab", 5),
+    ("vocab_keys", 5),
+]
+
+
+def open_database(db_path):
+    conn = sqlite3.connect(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        with conn:
+            for table, _ in TABLES + [("sources", 3)]:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return conn
+
+
+def first_changed_source(conn, sources):
+    stored = conn.execute(
+        "SELECT position, path, sha256 FROM sources ORDER BY position"
+    ).fetchall()
+    for position, source in enumerate(sources):
+        if position >= len(stored) or stored[position][1:] != source:
+            return position
+    # the chain may also have become shorter
+    return len(sources)
+
+
+def new_range(previous, current, index):
+    # objects in a list that were added by the file whose mark is `current`
+    start = previous[index] if index < len(previous) else 0
+    return range(start, current[index])
+
+
+def side_references(side, default):
+    groups = []
+    pair_groups = []
+    for token in tokenize_side(side, default):
+        if token["type"] == "group":
+            groups.append((token["group"], token["variant"]))
+        elif token["type"] == "pair":
+            pair_groups.append((token["pair_group"], token["alias"], token["variant"]))
+    return groups, pair_groups
+
+
+EMPTY_MARK = {"categories": [], "groups": [], "pair_groups": [], "chapters": 0}
+
+
+def collect_rows(deck, file_marks, first_source):
+    # rows for everything but the chapters, which are inserted one at a time
+    rows = {table: [] for table, _ in TABLES}
+
+    for source in range(first_source, len(file_marks)):
+        previous = file_marks[source - 1] if source > 0 else EMPTY_MARK
+        current = file_marks[source]
+
+        for i in range(len(previous["categories"]), len(current["categories"])):
+            category = deck.categories[i]
+            rows["categories"].append((i, category.name, source))
+            for count, name in enumerate(category.variant_names):
+                rows["variants"].append((i, count, name, source))
+        for i in range(len(current["categories"])):
+            category = deck.categories[i]
+            for j in new_range(previous["categories"], current["categories"], i):
+                rows["selectables"].append((i, j, source))
+                for count, value in enumerate(category.selectables[j].variants):
+                    rows["selectable_values"].append((i, j, count, value, source))
+
+        for i in range(len(previous["groups"]), len(current["groups"])):
+            group = deck.groups[i]
+            rows["groups"].append(
+                (i, group.name, group.category_name, group.key_variant_name, source)
+            )
+        for i in range(len(current["groups"])):
+            group = deck.groups[i]
+            for j in new_range(previous["groups"], current["groups"], i):
+                rows["group_keys"].append((i, j, group.keys[j], source))
+
+        for i in range(len(previous["pair_groups"]), len(current["pair_groups"])):
+            pair_group = deck.pair_groups[i]
+            if not pair_group:
+                continue
+            rows["pair_groups"].append(
+                (i, pair_group.name, int(pair_group.valid), source)
+            )
+            columns = zip(pair_group.column_names, pair_group.column_types)
+            for count, (name, type) in enumerate(columns):
+                rows["pair_columns"].append((i, count, name, type, source))
+        for i in range(len(current["pair_groups"])):
+            pair_group = deck.pair_groups[i]
+            for j in new_range(previous["pair_groups"], current["pair_groups"], i):
+                rows["pairs"].append((i, j, source))
+                for count, member in enumerate(pair_group.pairs[j]):
+                    rows["pair_members"].append((i, j, count, member, source))
+    return rows
+
+
+def chapter_sources(file_marks, first_source):
+    # (chapter index, source) for every chapter from first_source onwards
+    for source in range(first_source, len(file_marks)):
+        previous = file_marks[source - 1] if source > 0 else EMPTY_MARK
+        for i in range(previous["chapters"], file_marks[source]["chapters"]):
+            yield i, source
+
+
+def collect_chapter_rows(rows, i, chapter, source):
+    rows["chapters"].append((i, chapter.name, chapter.forced_first_side, source))
+    for count, variant in enumerate(chapter.column_variants):
+        rows["chapter_columns"].append((i, count, variant, source))
+    for j, template in enumerate(chapter.templates):
+        rows["templates"].append((i, j, source))
+        for count, side in enumerate(template.sides):
+            rows["template_sides"].append((i, j, count, side, source))
+            # sides are stored in the same order as the chapter's columns
+            default = chapter.column_variants[count]
+            groups, pair_groups = side_references(side, default)
+            for group_name, variant in groups:
+                rows["template_groups"].append(
+                    (i, j, count, group_name, variant, source)
+                )
+            for pg_name, alias, variant in pair_groups:
+                rows["template_pair_groups"].append(
+                    (i, j, count, pg_name, alias, variant, source)
+                )
+    for j, vocab in enumerate(chapter.vocab):
+        rows["vocab"].append(
+            (i, j, vocab.category_name, vocab.key_variant_name, source)
+        )
+        for count, key in enumerate(vocab.keys):
+            rows["vocab_keys"].append((i, j, count, key, source))
+
+
+def insert_rows(conn, rows):
+    for table, num_columns in TABLES:
+        if rows[table]:
+            placeholders = ",".join("?" * num_columns)
+            conn.executemany(
+                f"INSERT INTO {table} VALUES ({placeholders})", rows[table]
+            )
+
+
+def write_sqlite(deck, db_path, source_files, file_marks):
+    sources = [(path, file_sha256(path)) for path in source_files]
+    conn = open_database(db_path)
+    try:
+        first_source = first_changed_source(conn, sources)
+        rows = collect_rows(deck, file_marks, first_source)
+        with conn:
+            for table, _ in reversed(TABLES):
+                conn.execute(f"DELETE FROM {table} WHERE source >= ?", (first_source,))
+            conn.execute("DELETE FROM sources WHERE position >= ?", (first_source,))
+            insert_rows(conn, rows)
+            # one chapter at a time, so spilled chapters stay on disk
+            for i, source in chapter_sources(file_marks, first_source):
+                chapter = deck.chapters[i]
+                if not chapter:
+                    continue
+                rows = {table: [] for table, _ in TABLES}
+                collect_chapter_rows(rows, i, chapter, source)
+                insert_rows(conn, rows)
+            conn.executemany(
+                "INSERT INTO sources VALUES (?, ?, ?)",
+                [
+                    (position, path, sha256)
+                    for position, (path, sha256) in enumerate(sources)
+                    if position >= first_source
+                ],
+            )
+    finally:
+        conn.close()
+    return first_source
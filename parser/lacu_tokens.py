@@ -0,0 +1,64 @@
+import re
+
+# one pass over a template side finds both [group:variant] and
+# <pair_group:alias:variant> placeholders, in the order they appear
+PLACEHOLDER = re.compile(r"\[(.*?)\]|\<(.*?)\>")
+
+
+def tokenize_side(text, default):
+    # Splits a side into literal text, group references and pair group
+    # references. Placeholders without a variant resolve to the side's default
+    # variant; "explicit" records whether the side named one itself.
+    if default[:1] == "~":
+        default = default[1:]
+    tokens = []
+    position = 0
+    for match in PLACEHOLDER.finditer(text):
+        if match.start() > position:
+            tokens.append({"type": "literal", "text": text[position : match.start()]})
+        if match.group(1) is not None:
+            rep = match.group(1).split(":")
+            tokens.append(
+                {
+                    "type": "group",
+                    "group": rep[0],
+                    "variant": rep[1] if len(rep) > 1 else default,
+                    "explicit": len(rep) > 1,
+                }
+            )
+        else:
+            pg = match.group(2).split(":")
+            tokens.append(
+                {
+                    "type": "pair",
+                    "pair_group": pg[0],
+                    "alias": pg[1] if len(pg) > 1 else None,
+                    "variant": pg[2] if len(pg) > 2 else default,
+                    "explicit": len(pg) > 2,
+                }
+            )
+        position = match.end()
+    if position < len(text):
+        tokens.append({"type": "literal", "text": text[position:]})
+    return tokens
+
+
+def render_side(tokens):
+    # inverse of tokenize_side
+    parts = []
+    for token in tokens:
+        if token["type"] == "literal":
+            parts.append(token["text"])
+        elif token["type"] == "group":
+            if token["explicit"]:
+                parts.append(f"[{token['group']}:{token['variant']}]")
+            else:
+                parts.append(f"[{token['group']}]")
+        else:
+            fields = [token["pair_group"]]
+            if token["alias"] is not None:
+                fields.append(token["alias"])
+            if token["explicit"]:
+                fields.append(token["variant"])
+            parts.append("<" + ":".join(fields) + ">")
+    return "".join(parts)